@@ -9,15 +9,32 @@
 # Official repository: https://github.com/boostorg/json
 #
 
-import argparse
-import importlib
+import importlib.util
 import io
-import jinja2
-import json
 import os.path
 import re
 import sys
-import xml.etree.ElementTree as ET
+import time
+
+
+# classes derived from classes of modules which docca imports on first use,
+# so that each mode of operation only pays for importing what it needs; such
+# a class is defined by its factory when it is first needed, and from then on
+# it is a module attribute like any other class
+_class_factories = dict()
+
+def _defined(name):
+    result = globals().get(name)
+    if result is None:
+        result = _class_factories[name]()
+        globals()[name] = result
+    return result
+
+def __getattr__(name):
+    if name not in _class_factories:
+        raise AttributeError(
+            'module %r has no attribute %r' % (__name__, name))
+    return _defined(name)
 
 
 class Nullcontext():
@@ -51,20 +68,69 @@ class VirtualKind:
 class Linebreak():
     pass
 
+def normalize_parts(parts):
+    # adjacent strings are merged and empty ones are dropped, so that
+    # templates have fewer parts to go through
+    result = []
+    text = []
+    for part in parts:
+        if isinstance(part, str):
+            if part:
+                text.append(part)
+            continue
+        if text:
+            result.append(''.join(text))
+            text = []
+        result.append(part)
+    if text:
+        result.append(''.join(text))
+    return tuple(result)
+
+_whitespace_pattern = re.compile(r'\s+')
+_code_suffixes = (
+    (' &', '&'),
+    (' *', '*'),
+    (' &&', '&&'),
+    (' &...', '&...'),
+    (' *...', '*...'),
+    (' &&...', '&&...'),
+)
+def normalize_code_text(s):
+    # collapses whitespace and attaches trailing & and * to the type; only
+    # the first 32 runs of whitespace are collapsed, as templates used to
+    # call re.sub("\\s+", " ", s, re.U), which passes re.U as count
+    if not s:
+        return s
+    s = _whitespace_pattern.sub(' ', s, 32)
+    for suffix, replacement in _code_suffixes:
+        if s.endswith(suffix):
+            return s[:-len(suffix)] + replacement
+    return s
+
 class PhraseContainer:
     def __init__(self, parts):
-        self._parts = parts
+        self._parts = normalize_parts(parts)
 
     def __getitem__(self, pos):
         return self._parts[pos]
 
-    def __setitem__(self, pos, val):
-        self._parts[pos] = val
-
     def __len__(self):
         return len(self._parts)
 
+    @property
+    def code_text(self):
+        result = self.__dict__.get('_code_text')
+        if result is None:
+            result = normalize_code_text(self.text)
+            self._code_text = result
+        return result
+
 class Phrase(PhraseContainer):
+    def with_part(self, pos, part):
+        parts = list(self._parts)
+        parts[pos] = part
+        return Phrase(parts)
+
     @property
     def text(self):
         return ''.join((
@@ -249,9 +315,17 @@ class ParameterItem(Block):
     def is_out(self):
         return self.direction in ('out', 'inout')
 
+class CodeLine(str):
+    def __new__(cls, text, spans=()):
+        result = super().__new__(cls, text)
+        # (begin, end, highlight class) for each highlighted token
+        result.spans = tuple(spans)
+        return result
+
 class CodeBlock(Block):
     def __init__(self, lines):
-        self._lines = lines
+        self._lines = tuple(lines)
+        self._formatted = dict()
 
     def __getitem__(self, pos):
         return self._lines[pos]
@@ -259,6 +333,13 @@ class CodeBlock(Block):
     def __len__(self):
         return len(self._lines)
 
+    def formatted(self, nesting=''):
+        result = self._formatted.get(nesting)
+        if result is None:
+            result = ''.join([nesting + line + '\n' for line in self._lines])
+            self._formatted[nesting] = result
+        return result
+
 class Table(Block):
     def __init__(self, cols, rows, caption=None, width=None):
         self.cols = cols
@@ -403,22 +484,29 @@ def make_codeblock(element, index):
     lines = []
     for line in element:
         assert line.tag == 'codeline'
-        text = ''
+        fragments = []
+        spans = []
+        size = 0
         for hl in line:
             assert hl.tag == 'highlight'
-            if hl.text:
-                text += hl.text
-
+            token = [hl.text or '']
             for part in hl:
                 if part.tag == 'sp':
-                    text += ' '
-                elif part.tag == 'ref':
-                    text += part.text or ''
+                    token.append(' ')
+                elif part.tag == 'ref' and part.text:
+                    token.append(part.text)
                 if part.tail:
-                    text += part.tail
+                    token.append(part.tail)
+            token = ''.join(token)
+            if token:
+                fragments.append(token)
+                spans.append((size, size + len(token), hl.get('class')))
+                size += len(token)
+
             if hl.tail:
-                text += hl.tail
-        lines.append(text)
+                fragments.append(hl.tail)
+                size += len(hl.tail)
+        lines.append(CodeLine(''.join(fragments), spans))
 
     return CodeBlock(lines)
 
@@ -515,8 +603,13 @@ def make_entity_reference(
     if allow_missing_refs:
         return Phrase(phrase_content(element, index, allow_missing_refs=True))
 
+_empty_phrase = Phrase(())
+
 def text_with_refs(element, index):
-    return Phrase(phrase_content(element, index, allow_missing_refs=True))
+    parts = phrase_content(element, index, allow_missing_refs=True)
+    if not parts:
+        return _empty_phrase
+    return Phrase(parts)
 
 def resolve_type(element, index):
     result = text_with_refs(element, index)
@@ -525,9 +618,135 @@ def resolve_type(element, index):
         and isinstance(result[0], str)
         and result[0].startswith('constexpr')
     ):
-        result[0] = result[0][len('constexpr'):].lstrip()
+        result = result.with_part(0, result[0][len('constexpr'):].lstrip())
     return result
 
+class Index(dict):
+    """Mapping from ids to entities of a single build.
+
+    Also keeps the pool of description blocks shared between entities, and
+    the memo of sanitized path segments of their names.
+    """
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.shared_blocks = dict()
+        self.sanitized_segments = dict()
+
+def share_blocks(blocks, index):
+    """Returns blocks as an immutable sequence with structurally identical
+    subtrees replaced by a single shared instance.
+
+    With DISTRIBUTE_GROUP_DOC Doxygen copies group documentation into every
+    overload, so overloads end up referencing the same tree.
+    """
+    pool = getattr(index, 'shared_blocks', None)
+    if pool is None:
+        pool = dict()
+    return _share_sequence(blocks, pool)
+
+def _share(node, pool):
+    if node is None or isinstance(node, str):
+        return node
+
+    sharer = _sharers.get(type(node))
+    if sharer is None:
+        return node
+
+    key = sharer(node, pool)
+    return pool.setdefault(key, node)
+
+def _share_sequence(seq, pool):
+    seq = tuple(_share(item, pool) for item in seq)
+    return pool.setdefault(('seq', _share_key(seq)), seq)
+
+def _share_key(seq):
+    return tuple(
+        item if item is None or isinstance(item, str) else id(item)
+        for item in seq)
+
+def _share_phrase(phrase, pool):
+    phrase._parts = _share_sequence(phrase._parts, pool)
+    return (type(phrase), id(phrase._parts))
+
+def _share_entity_ref(ref, pool):
+    return _share_phrase(ref, pool) + (ref.entity,)
+
+def _share_url_link(link, pool):
+    return _share_phrase(link, pool) + (link.url,)
+
+def _share_singleton(node, pool):
+    return (type(node),)
+
+def _share_list(lst, pool):
+    lst._items = _share_sequence(
+        (_share_sequence(item, pool) for item in lst._items), pool)
+    return (List, lst.kind, id(lst._items))
+
+def _share_list_item(item, pool):
+    item._blocks = _share_sequence(item._blocks, pool)
+    return (ListItem, id(item._blocks))
+
+def _share_section(section, pool):
+    section.title = _share(section.title, pool)
+    section._blocks = _share_sequence(section._blocks, pool)
+    return (Section, section.kind, id(section.title), id(section._blocks))
+
+def _share_parameter_list(params, pool):
+    params._items = _share_sequence(params._items, pool)
+    return (ParameterList, params.kind, id(params._items))
+
+def _share_parameter_description(descr, pool):
+    descr.description = _share_sequence(descr.description, pool)
+    descr._params = _share_sequence(descr._params, pool)
+    return (
+        ParameterDescription, id(descr.description), id(descr._params))
+
+def _share_parameter_item(item, pool):
+    item.type = _share(item.type, pool)
+    item.name = _share(item.name, pool)
+    return (ParameterItem, id(item.type), id(item.name), item.direction)
+
+def _share_codeblock(block, pool):
+    return (
+        CodeBlock,
+        block._lines,
+        tuple(getattr(line, 'spans', None) for line in block._lines))
+
+def _share_table(table, pool):
+    table.caption = _share(table.caption, pool)
+    table._rows = _share_sequence(
+        (_share_sequence(row, pool) for row in table._rows), pool)
+    return (
+        Table, table.cols, table.width, id(table.caption), id(table._rows))
+
+def _share_cell(cell, pool):
+    cell._blocks = _share_sequence(cell._blocks, pool)
+    return (
+        Cell, id(cell._blocks), cell.col_span, cell.row_span, cell.is_header,
+        cell.horizontal_align, cell.vertical_align, cell.width, cell.role)
+
+_sharers = {
+    Phrase: _share_phrase,
+    Emphasised: _share_phrase,
+    Monospaced: _share_phrase,
+    Strong: _share_phrase,
+    Paragraph: _share_phrase,
+    EntityRef: _share_entity_ref,
+    UrlLink: _share_url_link,
+    Linebreak: _share_singleton,
+    EmDash: _share_singleton,
+    EnDash: _share_singleton,
+    List: _share_list,
+    ListItem: _share_list_item,
+    Section: _share_section,
+    ParameterList: _share_parameter_list,
+    ParameterDescription: _share_parameter_description,
+    ParameterItem: _share_parameter_item,
+    CodeBlock: _share_codeblock,
+    Table: _share_table,
+    Cell: _share_cell,
+}
+
 _chartable = {
     ord('\r'): None,
     ord('\n'): None,
@@ -569,7 +788,7 @@ class Location():
 class Entity():
     access = Access.public
 
-    def __init__(self, element, scope, index=dict()):
+    def __init__(self, element, scope, index=None):
         self.id = element.get('id')
         assert self.id
 
@@ -585,8 +804,10 @@ class Entity():
         self._brief = element.find('briefdescription')
         self._description = element.find('detaileddescription')
 
-        self.index = index
-        index[self.id] = self
+        # entities created without an index get their own, rather than
+        # sharing one between all builds
+        self.index = Index() if index is None else index
+        self.index[self.id] = self
 
     @property
     def location(self):
@@ -641,12 +862,34 @@ class Entity():
         return scope
 
     def resolve_references(self):
-        self.brief = make_blocks(self._brief, self.index)
+        self.brief = share_blocks(
+            make_blocks(self._brief, self.index), self.index)
         delattr(self, '_brief')
 
-        self.description = make_blocks(self._description, self.index)
+        self.description = share_blocks(
+            make_blocks(self._description, self.index), self.index)
         delattr(self, '_description')
 
+    @property
+    def brief_text(self):
+        result = self.__dict__.get('_brief_text')
+        if result is None:
+            result = ''.join(block.text for block in self.brief).strip()
+            self._brief_text = result
+        return result
+
+    @property
+    def external_url(self):
+        result = self.__dict__.get('_external_url')
+        if result is None:
+            result = ''.join(
+                ''.join(block.text for block in section).strip()
+                for section in self.description
+                if isinstance(section, Section)
+                    and section.kind == Section.See)
+            self._external_url = result
+        return result
+
     def update_scopes(self):
         pass
 
@@ -657,7 +900,7 @@ class Entity():
 class Compound(Entity):
     nametag = 'compoundname'
 
-    def __init__(self, element, scope, index=dict()):
+    def __init__(self, element, scope, index=None):
         super().__init__(element, scope, index)
 
         self.members = {}
@@ -689,7 +932,7 @@ class Compound(Entity):
 class Member(Entity):
     nametag = 'name'
 
-    def __init__(self, element, scope, index=dict()):
+    def __init__(self, element, scope, index=None):
         super().__init__(element, scope, index)
         self.access = element.get('prot') or Access.public
 
@@ -697,7 +940,7 @@ class Member(Entity):
 class Group(Compound):
     nametag = 'title'
 
-    def __init__(self, element, index=dict()):
+    def __init__(self, element, index=None):
         super().__init__(element, None, index)
 
     def adopt(self, entity, access):
@@ -705,7 +948,7 @@ class Group(Compound):
 
 
 class Templatable(Entity):
-    def __init__(self, element, scope, index=dict()):
+    def __init__(self, element, scope, index=None):
         super().__init__(element, scope, index)
         self._template_parameters = element.find('templateparamlist')
         self.is_specialization = (
@@ -729,7 +972,7 @@ class Type(Templatable):
 
 
 class Scope(Entity):
-    def __init__(self, element, scope, index=dict()):
+    def __init__(self, element, scope, index=None):
         super().__init__(element, scope, index)
 
         nesting = 0
@@ -781,7 +1024,7 @@ class Scope(Entity):
                     'typedef': TypeAlias,
                     'enum': Enum,
                 }[kind]
-                member = factory(member_def, section, self, index)
+                member = factory(member_def, section, self, self.index)
                 if type(member) is OverloadSet:
                     key = (member.name, member.access, member.kind)
                     self.members[key] = member
@@ -813,10 +1056,55 @@ class Scope(Entity):
         for key in bad_keys:
             del self.members[key]
 
+    def member_group(self, category, access, kind=None):
+        return self._partition()[0].get((category, access, kind), [])
+
+    def sorted_member_group(self, category, access, kind=None):
+        key = (category, access, kind)
+        groups, sorted_groups = self._partition()
+        result = sorted_groups.get(key)
+        if result is None:
+            result = sorted_groups[key] = sorted(groups.get(key, []))
+        return result
+
+    def _partition(self):
+        # members grouped by (category, access, kind), where category is one
+        # of 'types', 'functions', 'variables', and kind is None for types,
+        # FunctionKind for functions, and either FunctionKind.static or
+        # FunctionKind.nonstatic for variables; static variables which are
+        # also objects are omitted
+        result = getattr(self, '_member_groups', None)
+        if result is not None:
+            return result
+
+        objects = set(id(obj) for obj in getattr(self, 'objects', ()))
+        groups = dict()
+        for member in self.members.values():
+            if isinstance(member, Type):
+                key = ('types', member.access, None)
+            elif isinstance(member, OverloadSet):
+                key = ('functions', member.access, member.kind)
+            elif isinstance(member, Variable):
+                if not member.is_static:
+                    kind = FunctionKind.nonstatic
+                elif id(member) not in objects:
+                    kind = FunctionKind.static
+                else:
+                    continue
+                key = ('variables', member.access, kind)
+            else:
+                continue
+            groups.setdefault(key, []).append(member)
+
+        # groups are only sorted when sorted_member_group asks for them
+        result = (groups, dict())
+        self._member_groups = result
+        return result
+
 class Namespace(Scope, Compound):
     declarator = 'namespace'
 
-    def __init__(self, element, index=dict()):
+    def __init__(self, element, index=None):
         super().__init__(element, None, index)
 
     def resolve_references(self):
@@ -826,11 +1114,25 @@ class Namespace(Scope, Compound):
                 for func in member:
                     func.is_free = True
 
+    def sorted_members(self, category):
+        # members of a category ('types', 'functions', or 'variables') of any
+        # access and kind, sorted once for the pages which list them
+        result = getattr(self, '_sorted_members', None)
+        if result is None:
+            result = self._sorted_members = dict()
+        members = result.get(category)
+        if members is None:
+            kind = dict(
+                types=Type, functions=OverloadSet, variables=Variable)[category]
+            members = result[category] = sorted(
+                m for m in self.members.values() if isinstance(m, kind))
+        return members
+
 
 class Class(Scope, Compound, Type):
     declarator = 'class'
 
-    def __init__(self, element, index=dict()):
+    def __init__(self, element, index=None):
         super().__init__(element, None, index)
         self._bases = element.findall('basecompoundref')
 
@@ -868,14 +1170,14 @@ class Union(Class):
 
 
 class Enum(Scope, Type, Member):
-    def __init__(self, element, section, parent, index=dict()):
+    def __init__(self, element, section, parent, index=None):
         super().__init__(element, parent, index)
         self.is_scoped = element.get('strong') == 'yes'
         self._underlying_type = element.find('type')
 
         self.objects = []
         for child in element.findall('enumvalue'):
-            enumerator = Enumerator(child, section, self, index)
+            enumerator = Enumerator(child, section, self, self.index)
             self.objects.append(enumerator)
             assert enumerator.name not in enumerator.scope.members
             enumerator.scope.members[enumerator.name] = enumerator
@@ -892,7 +1194,7 @@ class Enum(Scope, Type, Member):
 
 
 class Value(Member, Templatable):
-    def __init__(self, element, parent, index=dict()):
+    def __init__(self, element, parent, index=None):
         super().__init__(element, parent, index)
         self.is_static = element.get('static') == 'yes'
         self.is_constexpr = element.get('constexpr') == 'yes'
@@ -905,7 +1207,7 @@ class Value(Member, Templatable):
 
 
 class Function(Value):
-    def __init__(self, element, section, parent, index=dict()):
+    def __init__(self, element, section, parent, index=None):
         super().__init__(element, parent, index)
         self.is_explicit = element.get('explicit') == 'yes'
         self.refqual = element.get('refqual')
@@ -1002,9 +1304,10 @@ class Parameter():
 
         self.description = element.find('briefdescription')
         if self.description is not None:
-            self.description = make_blocks(self.description, parent)
+            self.description = share_blocks(
+                make_blocks(self.description, parent.index), parent.index)
         else:
-            self.description = []
+            self.description = ()
 
         self.name = element.find('declname')
         if self.name is not None:
@@ -1014,7 +1317,7 @@ class Parameter():
         if self.array:
             assert isinstance(self.type[-1], str)
             assert self.type[-1].endswith('(&)')
-            self.type[-1] = self.type[-1][:-3]
+            self.type = self.type.with_part(-1, self.type[-1][:-3])
 
         self.args = text_with_refs(element.find('argsstring'), parent.index)
         if self.args:
@@ -1022,8 +1325,8 @@ class Parameter():
             assert isinstance(self.args[0], str)
             assert self.type[-1].endswith('(*')
             assert self.args[0].startswith(')(')
-            self.type[-1] = self.type[-1][:-2]
-            self.args[0] = self.args[0][1:]
+            self.type = self.type.with_part(-1, self.type[-1][:-2])
+            self.args = self.args.with_part(0, self.args[0][1:])
 
 
 class OverloadSet():
@@ -1093,7 +1396,7 @@ class OverloadSet():
 
 
 class Variable(Value):
-    def __init__(self, element, section, parent, index=dict()):
+    def __init__(self, element, section, parent, index=None):
         super().__init__(element, parent, index)
         self._value = element.find('initializer')
         self._type = element.find('type')
@@ -1114,12 +1417,12 @@ class Variable(Value):
             and self.type[-1].endswith('(*')
             and self.args[0].startswith(')(')
         ):
-            self.type[-1] = self.type[-1][:-2]
-            self.args[0] = self.args[0][1:]
+            self.type = self.type.with_part(-1, self.type[-1][:-2])
+            self.args = self.args.with_part(0, self.args[0][1:])
 
 
 class Enumerator(Variable):
-    def __init__(self, element, section, parent, index=dict()):
+    def __init__(self, element, section, parent, index=None):
         super().__init__(element, section, parent, index)
         self.is_constexpr = True
         self.is_const = True
@@ -1136,7 +1439,7 @@ class Enumerator(Variable):
 class TypeAlias(Member, Type):
     declarator = 'using'
 
-    def __init__(self, element, section, parent, index=dict()):
+    def __init__(self, element, section, parent, index=None):
         super().__init__(element, parent, index)
 
         self._aliased = element.find('type')
@@ -1170,24 +1473,32 @@ def work_around_repeated_member(scope, member):
     return None
 
 
-class AcceptOneorNone(argparse.Action):
-    def __init__(self, option_strings, dest, **kwargs):
-        if kwargs.get('nargs') is not None:
-            raise ValueError("nargs not allowed")
-        if kwargs.get('const') is not None:
-            raise ValueError("const not allowed")
-        if kwargs.get('default') is not None:
-            raise ValueError("default not allowed")
+def _define_accept_one_or_none():
+    import argparse
+    class AcceptOneorNone(argparse.Action):
+        def __init__(self, option_strings, dest, **kwargs):
+            if kwargs.get('nargs') is not None:
+                raise ValueError("nargs not allowed")
+            if kwargs.get('const') is not None:
+                raise ValueError("const not allowed")
+            if kwargs.get('default') is not None:
+                raise ValueError("default not allowed")
+
+            super().__init__(option_strings, dest, **kwargs)
 
-        super().__init__(option_strings, dest, **kwargs)
+        def __call__(self, parser, namespace, values, option_string=None):
+            if getattr(namespace, self.dest) is not None:
+                raise argparse.ArgumentError(self, "multiple values")
 
-    def __call__(self, parser, namespace, values, option_string=None):
-        if getattr(namespace, self.dest) is not None:
-            raise argparse.ArgumentError(self, "multiple values")
+            setattr(namespace, self.dest, values)
+    return AcceptOneorNone
 
-        setattr(namespace, self.dest, values)
+_class_factories['AcceptOneorNone'] = _define_accept_one_or_none
 
 def parse_args(args):
+    import argparse
+    AcceptOneorNone = _defined('AcceptOneorNone')
+
     parser = argparse.ArgumentParser(
         prog=args[0],
         description='Produces API reference in QuickBook markup')
@@ -1201,6 +1512,19 @@ def parse_args(args):
         '--output',
         action=AcceptOneorNone,
         help='Output file; STDOUT by default')
+    parser.add_argument(
+        '--output-dir',
+        metavar='DIR',
+        action=AcceptOneorNone,
+        help=(
+            'Write each page into its own file in directory DIR, and include '
+            'those files into the output'))
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=(
+            'Keep a manifest of pages\' inputs in the directory specified by '
+            '--output-dir, and only render pages whose inputs changed'))
     parser.add_argument(
         '-c', '--config',
         action='append',
@@ -1220,6 +1544,103 @@ def parse_args(args):
         action='append',
         default=[],
         help='Directory with template partials')
+    parser.add_argument(
+        '--cache-dir',
+        action=AcceptOneorNone,
+        help=(
+            'Directory for compiled template cache; '
+            'by default DOCCA_CACHE_DIR environment variable if it is set, '
+            'otherwise templates are not cached'))
+    parser.add_argument(
+        '--compile-templates',
+        metavar='OUT',
+        action=AcceptOneorNone,
+        help=(
+            'Compile templates into directory OUT, or into zip archive OUT if '
+            'it ends with .zip, instead of producing reference; the result '
+            'can only be used with the same versions of Python and Jinja'))
+    parser.add_argument(
+        '--bundle',
+        action=AcceptOneorNone,
+        help=(
+            'Directory or zip archive with compiled templates to use instead '
+            'of template sources'))
+    parser.add_argument(
+        '-j', '--render-jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Render pages in N worker processes; 1 by default')
+    # modes of operation other than a single run
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument(
+        '--watch',
+        action='store_true',
+        help=(
+            'Render again whenever XML, configuration, template, or extension '
+            'files change'))
+    parser.add_argument(
+        '--watch-interval',
+        type=float,
+        default=0.5,
+        metavar='SECONDS',
+        help=(
+            'How often to check files for changes in --watch mode; '
+            '0.5 by default'))
+    modes.add_argument(
+        '--batch',
+        metavar='JOBS',
+        action=AcceptOneorNone,
+        help=(
+            'Run jobs from JSON file JOBS, a list of objects with options '
+            'as keys, e.g. {"input": "xml/index.xml", "output": "ref.qbk"}'))
+    parser.add_argument(
+        '--batch-workers',
+        type=int,
+        metavar='N',
+        help='Run batch jobs in N worker processes; number of CPUs by default')
+    parser.add_argument(
+        '--timings',
+        nargs='?',
+        const='text',
+        choices=('text', 'json'),
+        metavar='FORMAT',
+        help=(
+            'Report wall and CPU time of each phase, and counts of processed '
+            'entities and bytes into STDERR, as text or as JSON'))
+    parser.add_argument(
+        '--profile-render',
+        nargs='?',
+        const=20,
+        type=int,
+        metavar='N',
+        help=(
+            'Report time and number of calls of each macro, and N entities '
+            'that took the most time to render (20 by default) into STDERR; '
+            'pages are rendered in a single process'))
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        action=AcceptOneorNone,
+        help=(
+            'Write Chrome trace events of reading and parsing compounds, '
+            'resolving references, loading extensions, and rendering pages '
+            'into FILE, which can be opened with chrome://tracing or '
+            'Perfetto'))
+    modes.add_argument(
+        '--daemon',
+        metavar='SOCKET',
+        action=AcceptOneorNone,
+        help=(
+            'Serve requests from clients on Unix socket SOCKET, keeping '
+            'templates and models between them'))
+    modes.add_argument(
+        '--connect',
+        metavar='SOCKET',
+        action=AcceptOneorNone,
+        help=(
+            'Send this invocation to the daemon listening on Unix socket '
+            'SOCKET'))
     parser.add_argument(
         '-D', '--directory',
         action=AcceptOneorNone,
@@ -1227,7 +1648,12 @@ def parse_args(args):
             'Directory with additional data files; '
             'by default INPUT parent directory if that is provided, '
             'otherwise PWD'))
-    return parser.parse_args(args[1:])
+    result = parser.parse_args(args[1:])
+    if result.incremental and not result.output_dir:
+        parser.error('--incremental requires --output-dir')
+    if result.watch and not (result.input and result.output):
+        parser.error('--watch requires --input and --output')
+    return result
 
 def open_input(stdin, args, cwd):
     data_dir = args.directory
@@ -1241,33 +1667,94 @@ def open_input(stdin, args, cwd):
         data_dir = data_dir or cwd
     return (file, ctx, data_dir)
 
+def file_digest(path):
+    import hashlib
+    result = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            result.update(chunk)
+    return result.digest()
+
+class AtomicFile():
+    # writes into a temporary file next to path, which on success replaces
+    # path if their contents differ, so that an unchanged file keeps its mtime
+    # and an interrupted run does not leave a truncated one
+    def __init__(self, path):
+        import tempfile
+        self.path = path
+        self.changed = None
+        fd, self.temp_path = tempfile.mkstemp(
+            prefix='.%s.' % os.path.basename(path),
+            suffix='.tmp',
+            dir=os.path.dirname(os.path.abspath(path)))
+        self.file = os.fdopen(fd, 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.temp_path)
+            return
+
+        try:
+            self.changed = (
+                file_digest(self.path) != file_digest(self.temp_path))
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            self.changed = True
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+
+        if self.changed:
+            os.chmod(self.temp_path, mode)
+            os.replace(self.temp_path, self.path)
+        else:
+            os.remove(self.temp_path)
+
 def open_output(stdout, args):
     if args.output:
-        file = open(args.output, 'w', encoding='utf-8')
-        ctx = file
+        ctx = AtomicFile(args.output)
+        file = ctx.file
     else:
         file = stdout
         ctx = Nullcontext()
     return (file, ctx)
 
 def load_configs(args):
+    import json
+    configs = []
+    for file_name in args.config:
+        with open(file_name, 'r', encoding='utf-8') as file:
+            config = json.load(file)
+        try:
+            StringReplacer(config.get('replace_strings', {}))
+        except re.error as e:
+            raise RuntimeError(
+                'Invalid pattern %r in replace_strings of %s: %s'
+                % (e.pattern, file_name, e))
+        configs.append(config)
+    return make_config(*configs)
+
+def make_config(*configs):
     result = {
         'include_private': False,
         'legacy_behavior': True,
     }
-    for file_name in args.config:
-        with open(file_name, 'r', encoding='utf-8') as file:
-            result.update( json.load(file) )
+    for config in configs:
+        result.update(config)
     if 'allowed_prefixes' not in result:
         allowed_prefixes = ['']
         default_ns = result.get('default_namespace')
         if default_ns:
             allowed_prefixes[0] = default_ns + '::'
         result['allowed_prefixes'] = allowed_prefixes
-
     return result
 
 def collect_compound_refs(file):
+    import xml.etree.ElementTree as ET
     tree = ET.parse(file)
     root = tree.getroot()
     for child in root:
@@ -1283,37 +1770,85 @@ def collect_compound_refs(file):
         assert refid
         yield refid
 
-def collect_data(parent_dir, refs):
-    result = dict()
+def collect_data(parent_dir, refs, sources=None, read=None, timings=None):
+    timings = timings or Timings()
+    with timings.phase('parse'):
+        result = load_compounds(parent_dir, refs, sources, read, timings.trace)
+    with timings.phase('update scopes'):
+        update_scopes(result)
+    with timings.phase('resolve references'):
+        resolve_references(result, timings.trace)
+    timings.count('entities', len(result))
+    return result
+
+def read_compound(file_name, trace=None):
+    import xml.etree.ElementTree as ET
+    name = os.path.basename(file_name)
+    with traced(trace, name, 'read'):
+        with open(file_name, 'rb') as file:
+            data = file.read()
+    with traced(trace, name, 'parse'):
+        return data, ET.fromstring(data)
+
+def load_compounds(parent_dir, refs, sources=None, read=None, trace=None):
+    read = read or (lambda file_name: read_compound(file_name, trace))
+    result = Index()
     for refid in refs:
         file_name = os.path.join(parent_dir, refid) + '.xml'
-        with open(file_name, 'r', encoding='utf-8') as file:
-            tree = ET.parse(file)
-            root = tree.getroot()
-            assert len(root) == 1
-
-            element = root[0]
-            assert element.tag == 'compounddef'
-
-            factory = {
-                'class': Class,
-                'namespace': Namespace,
-                'struct': Struct,
-                'union': Union,
-                'group': Group
-            }.get(element.get('kind'))
-            if not factory:
-                continue
+        data, root = read(file_name)
+        assert len(root) == 1
+        if sources is not None:
+            sources.add(refid, data, root)
+
+        element = root[0]
+        assert element.tag == 'compounddef'
+
+        factory = {
+            'class': Class,
+            'namespace': Namespace,
+            'struct': Struct,
+            'union': Union,
+            'group': Group
+        }.get(element.get('kind'))
+        if not factory:
+            continue
+        with traced(trace, refid, 'construct'):
             factory(element, result)
+    return result
+
+_memberdef_pattern = re.compile(rb'<memberdef\b[^>]*?\bid="([^"]+)"')
+_refid_pattern = re.compile(rb'\brefid="([^"]+)"')
 
-    for entity in result.values():
+class SourceFiles():
+    # content hashes of the XML that defines each entity, and entities it
+    # references; members are hashed separately from the rest of the compound
+    # file, so that pages of namespace members do not depend on each other
+    def __init__(self):
+        self.hashes = dict()
+        self.references = dict()
+
+    def _add(self, id, data):
+        import hashlib
+        self.hashes.setdefault(id, []).append(hashlib.sha1(data).hexdigest())
+        self.references.setdefault(id, set()).update(
+            m.group(1).decode('utf-8') for m in _refid_pattern.finditer(data))
+
+    def add(self, name, data, root):
+        self._add(root[0].get('id'), data)
+        for match in _memberdef_pattern.finditer(data):
+            end = data.find(b'</memberdef>', match.end())
+            self._add(
+                match.group(1).decode('utf-8'), data[match.start():end])
+
+def update_scopes(entities):
+    for entity in entities.values():
         assert entity is not None
         entity.update_scopes()
 
-    for entity in result.values():
-        entity.resolve_references();
-
-    return result
+def resolve_references(entities, trace=None):
+    for entity in entities.values():
+        with traced(trace, entity.id, 'resolve'):
+            entity.resolve_references();
 
 def docca_include_dir(script):
     return os.path.join(os.path.dirname(script), 'include')
@@ -1327,9 +1862,864 @@ def collect_include_dirs(template, include_dir, args):
     result.extend(args.include)
     return result
 
-def construct_environment(loader, config):
-    env = jinja2.Environment(
+def template_loader(template, include_dir, args):
+    import jinja2
+    if args.bundle:
+        return jinja2.ModuleLoader(args.bundle)
+    return jinja2.FileSystemLoader(
+        collect_include_dirs(template, include_dir, args))
+
+def compile_templates(env, template, target):
+    # stores the modules jinja2.Environment.compile_templates would, but as
+    # Python bytecode; ModuleLoader imports them like .pyc files without a
+    # source, so loading a bundle does not compile Python code either; the
+    # bundle is then specific to the Python version
+    import jinja2
+    import marshal
+    import zipfile
+
+    main_template = os.path.basename(template)
+    names = env.list_templates(
+        filter_func=lambda name: (
+            name.endswith('.jinja2') or name == main_template))
+
+    archive = None
+    if target.endswith('.zip'):
+        archive = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED)
+    else:
+        os.makedirs(target, exist_ok=True)
+    try:
+        for name in names:
+            source, filename, _ = env.loader.get_source(env, name)
+            module = env.compile(source, name, filename, True, True)
+            file_name = jinja2.ModuleLoader.get_module_filename(name) + 'c'
+            # a header with no source timestamp, which imports do not check
+            # for modules without a source
+            data = importlib.util.MAGIC_NUMBER + bytes(12) + marshal.dumps(
+                compile(module, file_name, 'exec'))
+            if archive:
+                archive.writestr(file_name, data)
+            else:
+                with open(os.path.join(target, file_name), 'wb') as file:
+                    file.write(data)
+    finally:
+        if archive:
+            archive.close()
+
+class StringReplacer():
+    # applies regex replacements in order, equivalent to
+    #     for src, tgt in table.items(): s = re.sub(src, tgt, s, flags=re.U)
+    # but with patterns compiled once, and with a single combined pattern to
+    # skip strings which no replacement applies to
+    _unsafe_for_prefilter = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+    def __init__(self, table):
+        self.table = dict(table)
+        self._rules = [
+            (re.compile(src, re.U), tgt) for src, tgt in self.table.items()]
+
+        self._prefilter = None
+        if self._rules and not any(
+                self._unsafe_for_prefilter.search(src) for src in self.table):
+            try:
+                self._prefilter = re.compile(
+                    '|'.join('(?:%s)' % src for src in self.table), re.U)
+            except re.error:
+                pass
+
+    def __call__(self, s):
+        if self._prefilter is not None and not self._prefilter.search(s):
+            return s
+        for pattern, tgt in self._rules:
+            s = pattern.sub(tgt, s)
+        return s
+
+_path_segment_replacements = (
+    ('[', '__lb_'),
+    (']', '_rb_'),
+    ('(', '_lp_'),
+    (')', '_rp_'),
+    ('<=>', '_spshp_'),
+    ('operator>', 'operator__gt_'),
+    ('operator~', 'operator_bnot_'),
+    ('->', '__arrow_'),
+    ('=', '_eq_'),
+    ('!', '__not_'),
+    ('+', '_plus_'),
+    ('-', '_minus_'),
+    ('&', '_and_'),
+    ('|', '_or_'),
+    ('^', '_xor_'),
+    ('*', '__star_'),
+    ('/', '_slash_'),
+    ('%', '_mod_'),
+    ('<', '_lt_'),
+    ('>', '_gt_'),
+    ('~', '_dtor_'),
+    (',', '_comma_'),
+    (':', '_'),
+    (' ', '_'),
+)
+def sanitize_path_segment(segment, memo=None):
+    result = memo.get(segment) if memo is not None else None
+    if result is None:
+        result = segment
+        for old, new in _path_segment_replacements:
+            result = result.replace(old, new)
+        if memo is not None:
+            memo[segment] = result
+    return result
+
+def _sanitized_name(entity):
+    # with the memo of the build the entity belongs to
+    return sanitize_path_segment(
+        entity.name, getattr(entity.index, 'sanitized_segments', None))
+
+def _is_function(entity):
+    return isinstance(entity, (Function, OverloadSet))
+
+def entity_anchor(entity):
+    # OverloadSet forwards unknown attributes to its first function, so the
+    # memo has to be looked up in the instance dictionary directly
+    result = entity.__dict__.get('_anchor')
+    if result is not None:
+        return result
+
+    if isinstance(entity, Function) and not entity.is_sole_overload:
+        result = 'overload%s' % (entity.overload_index + 1)
+    elif entity.scope and not isinstance(entity.scope, Namespace):
+        result = _sanitized_name(entity)
+        if _is_function(entity) and entity.is_friend:
+            result += '_fr'
+        if _is_function(entity) and entity.is_free:
+            result += '_fe'
+    else:
+        result = '__'.join(
+            _sanitized_name(segment) for segment in entity.path)
+
+    entity.__dict__['_anchor'] = result
+    return result
+
+def entity_link(entity, prefer_overload=False, link_prefix=''):
+    links = entity.__dict__.get('_links')
+    if links is None:
+        links = entity.__dict__['_links'] = dict()
+    key = (prefer_overload, link_prefix)
+    result = links.get(key)
+    if result is not None:
+        return result
+
+    if isinstance(entity, Enumerator):
+        result = entity_link(entity.enum, link_prefix=link_prefix)
+    elif isinstance(entity, Namespace):
+        result = link_prefix + '__'.join(
+            _sanitized_name(segment) for segment in entity.path)
+    else:
+        result = ''
+        if entity.scope:
+            result = entity_link(entity.scope, prefer_overload, link_prefix)
+            result += '__' if isinstance(entity.scope, Namespace) else '.'
+        result += _sanitized_name(entity)
+        if _is_function(entity):
+            if entity.is_friend:
+                result += '_fr'
+            elif entity.is_free and isinstance(entity.scope, Type):
+                result += '_fe'
+        if (isinstance(entity, Function)
+                and not prefer_overload
+                and not entity.is_sole_overload):
+            result += '.overload%s' % (entity.overload_index + 1)
+
+    links[key] = result
+    return result
+
+def link_prefix(config):
+    return str(config['link_prefix']) if 'link_prefix' in config else ''
+
+def escape(s):
+    return s.replace('[', '\\[').replace(']', '\\]')
+
+def abridged_fqn(entity, config):
+    default_ns = config.get('default_namespace')
+    prefix = default_ns + '::' if default_ns else ''
+    result = entity.fully_qualified_name
+    if result.startswith(prefix):
+        result = result[len(prefix):]
+    return escape(result)
+
+class QuickBookMarkup():
+    # Renders block and phrase trees into QuickBook exactly as the
+    # corresponding macros in docca/quickbook/components.jinja2 used to do.
+    # Public methods return strings, private ones append to a list.
+    _section_headings = {
+        Section.See: 'See Also',
+        Section.Returns: 'Return Value',
+        Section.Author: 'Author',
+        Section.Authors: 'Authors',
+        Section.Version: 'Version',
+        Section.Since: 'Since',
+        Section.Date: 'Date',
+        Section.Note: 'Remarks',
+        Section.Warning: 'Warning',
+        Section.Preconditions: 'Preconditions',
+        Section.Postconditions: 'Postconditions',
+        Section.Copyright: 'Copyright',
+        Section.Invariants: 'Invariants',
+        Section.Remarks: 'Remarks',
+        Section.Attention: 'Attention',
+        Section.Custom: 'Paragraph',
+        Section.RCS: 'RCS',
+    }
+
+    _parameter_lists = {
+        ParameterList.Parameters: ('Parameters', 'Name', 'Description'),
+        ParameterList.TemplateParameters: (
+            'Template Parameters', 'Type', 'Description'),
+        ParameterList.Exceptions: ('Exceptions', 'Type', 'Thrown On'),
+        ParameterList.ReturnValues: ('Return Values', 'Type', 'Description'),
+    }
+
+    def __init__(self, config):
+        self.config = config
+        self.replacer = None
+        self._block_handlers = {
+            Paragraph: self._paragraph,
+            List: self._itemised,
+            Section: self._subsection_block,
+            CodeBlock: self._code_block,
+            ParameterList: self._parameter_list_block,
+            Table: self._table_block,
+        }
+        self._part_handlers = {
+            str: self._text,
+            EmDash: self._dash,
+            EnDash: self._dash,
+            Monospaced: self._monospaced,
+            Emphasised: self._emphasised,
+            Strong: self._strong,
+            EntityRef: self._entity_ref,
+            UrlLink: self._url_link,
+            Linebreak: self._linebreak,
+            Phrase: self._nested_phrase,
+        }
+
+    def description(self, parts, nesting='', title=None):
+        out = []
+        self._description(out, parts, nesting, title)
+        return ''.join(out)
+
+    def phrase(self, para, in_code=False):
+        out = []
+        self._phrase(out, para, in_code)
+        return ''.join(out)
+
+    def phrase_part(self, part, in_code=False):
+        out = []
+        self._phrase_part(out, part, in_code)
+        return ''.join(out)
+
+    def itemised(self, lst, nesting=''):
+        out = []
+        self._itemised(out, lst, nesting)
+        return ''.join(out)
+
+    def table(self, part):
+        out = []
+        self._table(out, part)
+        return ''.join(out)
+
+    def parameter_list(self, part):
+        out = []
+        self._parameter_list(out, part)
+        return ''.join(out)
+
+    def subsection(self, sub):
+        out = []
+        self._subsection(out, sub)
+        return ''.join(out)
+
+    def _handler(self, handlers, part):
+        kind = type(part)
+        result = handlers.get(kind)
+        if result is None:
+            for base in kind.__mro__[1:]:
+                result = handlers.get(base)
+                if result is not None:
+                    handlers[kind] = result
+                    break
+            else:
+                raise TypeError(
+                    'unhandled type %s' % kind.__name__)
+        return result
+
+    def _description(self, out, parts, nesting='', title=None):
+        first = True
+        for part in parts:
+            if (first and title
+                    and not isinstance(part, (Section, ParameterList))):
+                out.append('[heading ' + str(title) + ']\n')
+            first = False
+            self._handler(self._block_handlers, part)(out, part, nesting)
+
+    def _paragraph(self, out, part, nesting):
+        self._phrase(out, part, False)
+        out.append('\n\n')
+
+    def _subsection_block(self, out, part, nesting):
+        self._subsection(out, part)
+
+    def _code_block(self, out, part, nesting):
+        out.append('\n' + nesting + '```\n')
+        out.append(part.formatted(nesting))
+        out.append(nesting + '```\n')
+
+    def _parameter_list_block(self, out, part, nesting):
+        self._parameter_list(out, part)
+        out.append('\n')
+
+    def _table_block(self, out, part, nesting):
+        self._table(out, part)
+
+    def _itemised(self, out, lst, nesting=''):
+        bullet = nesting + ('#' if lst.is_ordered else '*') + ' '
+        for item in lst:
+            out.append(bullet)
+            self._description(out, item, nesting + '       ')
+
+    def _subsection(self, out, sub):
+        if sub.title:
+            out.append('[heading ')
+            self._phrase(out, sub.title, False)
+            out.append(']')
+        elif sub.kind:
+            out.append('[heading %s]' % self._section_headings.get(
+                sub.kind, 'Unknown'))
+        out.append('\n')
+        self._description(out, sub)
+
+    def _summary_table(self, out, sequence, title, cols, caller):
+        sequence = list(sequence)
+        for n, row in enumerate(sequence):
+            if not n:
+                out.append('[heading %s]\n[table [%s]' % (
+                    title, ''.join('[%s]' % col for col in cols)))
+            out.append('\n  [\n    ')
+            caller(out, row)
+            out.append('\n  ]')
+            if n + 1 == len(sequence):
+                out.append('\n]\n')
+
+    def _parameter_list(self, out, part):
+        title, col1, col2 = self._parameter_lists[part.kind]
+        self._summary_table(
+            out, part, title, (col1, col2), self._parameter_row)
+
+    def _parameter_row(self, out, param_block):
+        out.append('[')
+        sep = ''
+        for item in param_block:
+            out.append(sep + '`')
+            sep = ', '
+            if item.type:
+                self._phrase(out, item.type, False)
+                out.append(' ')
+            self._phrase(out, item.name, False)
+            out.append('`')
+        out.append('\n    ]\n    [\n')
+        self._description(out, param_block.description)
+        out.append('\n    ]')
+
+    def _table(self, out, part):
+        out.append('[table ')
+        if part.caption:
+            self._phrase(out, part.caption, False)
+        for row in part:
+            out.append('\n  [')
+            for cell in row:
+                out.append('\n    [ ')
+                self._description(out, cell, '      ')
+                out.append('    ]')
+            out.append('\n  ]')
+        out.append('\n]\n')
+
+    def _phrase(self, out, para, in_code):
+        if in_code and self.config.get('legacy_behavior'):
+            if para.text:
+                out.append(self.replace(para.code_text))
+            return
+        handlers = self._part_handlers
+        for part in para:
+            handler = handlers.get(type(part))
+            if handler is None:
+                handler = self._handler(handlers, part)
+            handler(out, part, in_code)
+
+    def _phrase_part(self, out, part, in_code):
+        self._handler(self._part_handlers, part)(out, part, in_code)
+
+    def update(self):
+        # the replacer is built on first use, and again if the configuration
+        # has changed since the previous render
+        table = self.config.get('replace_strings', dict())
+        if self.replacer is None or self.replacer.table != table:
+            self.replacer = StringReplacer(table)
+        return self.replacer
+
+    def replace(self, s):
+        return (self.replacer or self.update())(s)
+
+    def _text(self, out, part, in_code):
+        if not part:
+            return
+        elif in_code:
+            out.append(self.replace(normalize_code_text(part)))
+        else:
+            out.append(escape(part))
+
+    def _dash(self, out, part, in_code):
+        out.append(part.text)
+
+    def _monospaced(self, out, part, in_code):
+        out.append('`')
+        self._phrase(out, part, True)
+        out.append('`')
+
+    def _emphasised(self, out, part, in_code):
+        out.append("['")
+        self._phrase(out, part, in_code)
+        out.append(']')
+
+    def _strong(self, out, part, in_code):
+        out.append('[*')
+        self._phrase(out, part, in_code)
+        out.append(']')
+
+    def _entity_ref(self, out, part, in_code):
+        if in_code:
+            out.append('``')
+        entity = part.entity
+        marker = self.config.get('external_marker')
+        if marker and entity.brief_text == marker:
+            out.append('[@' + entity.external_url)
+        else:
+            out.append('[link ' + entity_link(
+                entity, True, link_prefix(self.config)))
+        if in_code:
+            out.append(' [^%s]]``' % abridged_fqn(entity, self.config))
+        else:
+            out.append(' `')
+            self._phrase(out, part, True)
+            out.append('`]')
+
+    def _url_link(self, out, part, in_code):
+        out.append('[@%s ' % part.url)
+        self._phrase(out, part, in_code)
+        out.append(']')
+
+    def _linebreak(self, out, part, in_code):
+        out.append('\n\n')
+
+    def _nested_phrase(self, out, part, in_code):
+        self._phrase(out, part, in_code)
+
+class PrefixSet():
+    def __init__(self, prefixes):
+        self._root = dict()
+        self._empty = True
+        for prefix in prefixes:
+            node = self._root
+            for c in prefix:
+                node = node.setdefault(c, dict())
+            node[None] = True
+            self._empty = False
+
+    def related(self, s):
+        # True if s starts with one of the prefixes, or is itself a prefix of
+        # one of them
+        if self._empty:
+            return False
+        node = self._root
+        for c in s:
+            if None in node:
+                return True
+            node = node.get(c)
+            if node is None:
+                return False
+        return True
+
+class Visibility():
+    def __init__(self, config):
+        self.config = config
+        self._prefixes = None
+        self._visible = dict()
+
+    @property
+    def prefixes(self):
+        if self._prefixes is None:
+            self._prefixes = PrefixSet(self.config['allowed_prefixes'])
+        return self._prefixes
+
+    def is_external(self, entity):
+        marker = self.config.get('external_marker')
+        return bool(marker) and entity.brief_text == marker
+
+    def is_visible(self, entity):
+        result = self._visible.get(entity)
+        if result is None:
+            result = (
+                (entity.access != Access.private
+                    or bool(self.config.get('include_private')))
+                and not self.is_external(entity)
+                and self.prefixes.related(entity.fully_qualified_name))
+            self._visible[entity] = result
+        return result
+
+def _define_environment():
+    import jinja2
+    class Environment(jinja2.Environment):
+        compile_time = 0.0
+        compile_cpu_time = 0.0
+        compiled_templates = 0
+        trace = None
+
+        def compile(self, *args, **kw):
+            name = args[1] if len(args) > 1 else kw.get('name')
+            start = time.perf_counter()
+            start_cpu = time.process_time()
+            try:
+                with traced(self.trace, name or '<string>', 'compile'):
+                    return super().compile(*args, **kw)
+            finally:
+                self.compile_time += time.perf_counter() - start
+                self.compile_cpu_time += time.process_time() - start_cpu
+                self.compiled_templates += 1
+    return Environment
+
+_class_factories['Environment'] = _define_environment
+
+def _define_bytecode_cache():
+    import hashlib
+    import jinja2
+    class BytecodeCache(jinja2.FileSystemBytecodeCache):
+        def __init__(self, directory, files=()):
+            os.makedirs(directory, exist_ok=True)
+            super().__init__(directory, '__docca_%s.cache')
+
+            # compiled templates depend on Jinja and on the environment,
+            # which is set up by docca and extensions
+            salt = hashlib.sha1(jinja2.__version__.encode('utf-8'))
+            for file_name in (__file__,) + tuple(files):
+                with open(file_name, 'rb') as file:
+                    salt.update(file.read())
+            self.salt = salt.hexdigest()
+
+        def get_cache_key(self, name, filename=None):
+            return super().get_cache_key(self.salt + '|' + name, filename)
+    return BytecodeCache
+
+_class_factories['BytecodeCache'] = _define_bytecode_cache
+
+class FragmentCache():
+    # rendered fragments memoized for the duration of a single render by the
+    # macro, the identity of the object it was called with, and the rest of
+    # the arguments
+    def __init__(self):
+        self._fragments = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, macro, obj, *args, **kw):
+        key = (macro, id(obj), args, tuple(sorted(kw.items())))
+        entry = self._fragments.get(key)
+        if entry is not None and entry[0] is obj:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        result = macro(obj, *args, **kw)
+        # the object is kept alive, so that its id is not reused
+        self._fragments[key] = (obj, result)
+        return result
+
+_page_placeholder = '\0page%s\0'
+_page_pattern = re.compile('\0page([0-9]+)\0')
+
+class PageRenderer():
+    # renders pages in place, or, while deferred is a list, records them to
+    # be rendered later and returns placeholders for them; namespaces are
+    # always rendered in place, so that their members become separate pages
+    def __init__(self):
+        self.deferred = None
+        self.trace = None
+
+    def __call__(self, macro, entity):
+        if self.deferred is None or isinstance(entity, Namespace):
+            with traced(self.trace, _entity_name(entity), 'page'):
+                return macro(entity)
+        self.deferred.append((macro, entity))
+        return _page_placeholder % (len(self.deferred) - 1)
+
+def _entity_name(entity):
+    return str(getattr(entity, 'fully_qualified_name', entity))
+
+def render_page(macro, entity, trace=None):
+    with traced(trace, _entity_name(entity), 'page'):
+        return str(macro(entity))
+
+_worker = None
+def _start_worker(worker):
+    # worker processes are forked, so worker is inherited rather than pickled;
+    # tasks sent to the process are then run by it
+    global _worker
+    _worker = worker
+
+def _run_task(*args):
+    return _worker(*args)
+
+class _PageTasks():
+    def __init__(self, pages, trace):
+        self.pages = pages
+        self.trace = trace
+
+    def __call__(self, n):
+        macro, entity = self.pages[n]
+        if self.trace is None:
+            return render_page(macro, entity)
+        # events are sent back to the parent process
+        return self.trace.separately(render_page, macro, entity, self.trace)
+
+def render_pages(pages, jobs, trace=None):
+    import multiprocessing
+    # worker processes are forked, so that they share the model and the
+    # template environment with the parent instead of receiving copies
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        jobs = 1
+    # e.g. in a batch worker
+    if multiprocessing.current_process().daemon:
+        jobs = 1
+    if jobs < 2 or len(pages) < 2:
+        return [render_page(macro, entity, trace) for macro, entity in pages]
+
+    with context.Pool(
+            min(jobs, len(pages)),
+            _start_worker,
+            (_PageTasks(pages, trace),)) as pool:
+        result = pool.map(
+            _run_task,
+            range(len(pages)),
+            chunksize=max(1, len(pages) // (jobs * 4)))
+    if trace is None:
+        return result
+    return trace.merge(result)
+
+def write_if_changed(path, text):
+    ctx = AtomicFile(path)
+    with ctx as file:
+        file.write(text)
+    return ctx.changed
+
+class PageInputs():
+    # computes a fingerprint of everything a page depends on: the XML
+    # defining the page's entity and its members, names of its scopes, the
+    # properties of referenced entities that links to them are made of, and
+    # the digest of configuration and templates
+    def __init__(self, index, sources, digest):
+        self.index = index
+        self.sources = sources
+        self.digest = digest
+
+    def _reference(self, entity):
+        return '|'.join((
+            entity_link(entity, True),
+            entity_link(entity),
+            entity.fully_qualified_name,
+            entity.brief_text,
+            entity.external_url,
+        ))
+
+    def __call__(self, entity):
+        import hashlib
+        hashes = []
+        targets = dict()
+        if entity.scope is not None:
+            targets[entity.scope.id] = entity.scope
+
+        pending = [entity]
+        while pending:
+            entity = pending.pop()
+            if isinstance(entity, OverloadSet):
+                pending.extend(entity)
+                continue
+            hashes.extend(self.sources.hashes.get(entity.id, ()))
+            for refid in self.sources.references.get(entity.id, ()):
+                target = self.index.get(refid)
+                if target is not None:
+                    targets[refid] = target
+            # bases can also be found by name
+            for base in getattr(entity, 'bases', ()):
+                for part in base.base:
+                    if isinstance(part, EntityRef):
+                        targets[part.entity.id] = part.entity
+
+            members = getattr(entity, 'members', None)
+            if members:
+                pending.extend(members.values())
+            pending.extend(getattr(entity, 'objects', ()))
+
+        result = hashlib.sha1(self.digest.encode('utf-8'))
+        for h in sorted(hashes):
+            result.update(h.encode('utf-8'))
+        for id in sorted(targets):
+            result.update(self._reference(targets[id]).encode('utf-8'))
+        return result.hexdigest()
+
+def environment_digest(env, files=()):
+    import hashlib
+    import jinja2
+    import json
+    # templates loaded from a bundle cannot be listed, so pages rendered with
+    # them are never reused
+    try:
+        templates = sorted(env.loader.list_templates())
+    except TypeError:
+        return None
+
+    result = hashlib.sha1(jinja2.__version__.encode('utf-8'))
+    for file_name in (__file__,) + tuple(files):
+        with open(file_name, 'rb') as file:
+            result.update(file.read())
+    for name in templates:
+        source, _, _ = env.loader.get_source(env, name)
+        result.update(('|%s:%s' % (name, source)).encode('utf-8'))
+    config = json.dumps(env.globals['Config'], sort_keys=True, default=str)
+    result.update(config.encode('utf-8'))
+    return result.hexdigest()
+
+class PageFiles():
+    # writes each page into its own file in directory, and replaces the page
+    # with an include of that file; files that would not change are left
+    # untouched
+    #
+    # a manifest of page files is kept in the directory, so that files of
+    # pages which no longer exist are removed; if inputs is provided, it also
+    # has fingerprints of pages' inputs, and pages whose inputs did not change
+    # since the previous run are not rendered again
+    manifest_name = 'docca-manifest.json'
+    manifest_version = 1
+
+    def __init__(self, directory, base='.', inputs=None):
+        self.directory = directory
+        self.base = base
+        self.inputs = inputs
+        self.written = []
+        self.unchanged = []
+        self.reused = []
+        self._names = set()
+        self._pages = dict()
+        self._manifest = dict()
+
+    def file_name(self, entity):
+        name = entity_link(entity)
+        # file systems may be case-insensitive
+        stem, n = name, 1
+        while name.lower() in self._names:
+            n += 1
+            name = '%s_%s' % (stem, n)
+        self._names.add(name.lower())
+        return name + '.qbk'
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, self.manifest_name)
+
+    def load_manifest(self):
+        import json
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return dict()
+        if manifest.get('version') != self.manifest_version:
+            return dict()
+        return manifest.get('pages', dict())
+
+    def stale(self, entities):
+        # assigns files to pages, and returns positions of those pages that
+        # have to be rendered
+        result = []
+        self._manifest = self.load_manifest()
+        for n, entity in enumerate(entities):
+            page = self._pages[entity.id] = dict(file=self.file_name(entity))
+            if self.inputs is None or self.inputs.digest is None:
+                result.append(n)
+                continue
+
+            page['inputs'] = self.inputs(entity)
+            old = self._manifest.get(entity.id)
+            if (not old
+                    or old.get('inputs') != page['inputs']
+                    or old.get('file') != page['file']
+                    or (old.get('text') is None
+                        and not os.path.exists(self._path(page['file'])))):
+                result.append(n)
+            else:
+                page['text'] = old.get('text')
+        return result
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def _include(self, file_name):
+        path = os.path.relpath(self._path(file_name), self.base)
+        return '\n[include %s]\n' % path.replace(os.sep, '/')
+
+    def __call__(self, entity, text=None):
+        page = self._pages.get(entity.id)
+        if page is None:
+            page = self._pages[entity.id] = dict(file=self.file_name(entity))
+
+        if text is None:
+            if page.get('text') is not None:
+                return page['text']
+            self.reused.append(self._path(page['file']))
+            return self._include(page['file'])
+
+        if not text.strip():
+            page['text'] = text
+            return text
+
+        path = self._path(page['file'])
+        if write_if_changed(path, text.strip('\n') + '\n'):
+            self.written.append(path)
+        else:
+            self.unchanged.append(path)
+        return self._include(page['file'])
+
+    def save_manifest(self):
+        import json
+        # files of pages that no longer exist are removed
+        files = set(page['file'] for page in self._pages.values())
+        for page in self._manifest.values():
+            name = page.get('file')
+            if (name and name not in files
+                    and os.path.dirname(name) == ''
+                    and os.path.exists(self._path(name))):
+                os.remove(self._path(name))
+
+        manifest = dict(version=self.manifest_version, pages=self._pages)
+        with AtomicFile(self.manifest_path) as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+
+def cache_directory(args, environ):
+    return args.cache_dir or environ.get('DOCCA_CACHE_DIR') or None
+
+def construct_environment(loader, config, bytecode_cache=None):
+    import jinja2
+    env = _defined('Environment')(
         loader=loader,
+        bytecode_cache=bytecode_cache,
         autoescape=False,
         undefined=jinja2.StrictUndefined,
         extensions=[
@@ -1385,9 +2775,37 @@ def construct_environment(loader, config):
     env.tests['ParameterDescription'] = lambda x: isinstance(x, ParameterDescription)
     env.tests['ParameterItem'] = lambda x: isinstance(x, ParameterItem)
 
+    markup = QuickBookMarkup(config)
+    env.markup = markup
+    env.filters['replace_strings'] = markup.replace
+    env.filters['code_text'] = lambda x: (
+        x.code_text if isinstance(x, PhraseContainer)
+        else normalize_code_text(x))
+    env.filters['sanitize_path_segment'] = sanitize_path_segment
+    env.filters['anchor'] = entity_anchor
+    env.filters['link'] = lambda entity, prefer_overload=False: entity_link(
+        entity, prefer_overload, link_prefix(config))
+
+    env.filters['description'] = markup.description
+    env.filters['phrase'] = markup.phrase
+    env.filters['phrase_part'] = markup.phrase_part
+    env.filters['itemised'] = markup.itemised
+    env.filters['table'] = markup.table
+    env.filters['parameter_list'] = markup.parameter_list
+    env.filters['subsection'] = markup.subsection
+
+    env.visibility = Visibility(config)
+    env.fragments = FragmentCache()
+    env.globals['render_once'] = lambda *args, **kw: env.fragments(
+        *args, **kw)
+    env.pages = PageRenderer()
+    env.globals['page'] = lambda macro, entity: env.pages(macro, entity)
+    env.tests['visible'] = lambda x: env.visibility.is_visible(x)
+    env.tests['external'] = lambda x: env.visibility.is_external(x)
+
     return env
 
-def load_extensions(files):
+def load_extensions(files, trace=None):
     result = []
     counter = 0
     for file in files:
@@ -1398,46 +2816,852 @@ def load_extensions(files):
         name = 'docca._ext' + str(counter)
         spec = importlib.util.spec_from_file_location(name, file)
         module = importlib.util.module_from_spec(spec)
+        # the module is only registered while it executes, so that loading
+        # extensions for one build does not affect others
+        previous = sys.modules.get(name)
         sys.modules[name] = module
-        spec.loader.exec_module(module)
+        try:
+            with traced(
+                    trace, 'load ' + os.path.basename(file), 'extension'):
+                spec.loader.exec_module(module)
+        finally:
+            if previous is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = previous
         result.append(module)
         counter += 1
 
     return result
 
-def install_extensions(env, exts):
+def install_extensions(env, exts, trace=None):
     for ext in exts:
-        ext.install_docca_extension(env)
+        name = os.path.basename(getattr(ext, '__file__', None) or str(ext))
+        with traced(trace, 'install ' + name, 'extension'):
+            ext.install_docca_extension(env)
     return env
 
-def render(env, file_name, output, data):
+def render(
+        env, file_name, output, data, jobs=1, page_files=None, timings=None):
+    timings = timings or Timings()
+    if hasattr(env, 'visibility'):
+        env.visibility = Visibility(env.visibility.config)
+    if hasattr(env, 'fragments'):
+        env.fragments = FragmentCache()
+    if hasattr(env, 'markup'):
+        env.markup.update()
+    # events of this run go to its trace
+    if hasattr(env, 'trace'):
+        env.trace = timings.trace
+    if hasattr(env, 'pages'):
+        env.pages.trace = timings.trace
+
+    # templates are compiled when they are first used, which may happen in
+    # the middle of rendering
+    compile_time = getattr(env, 'compile_time', 0.0)
+    compile_cpu_time = getattr(env, 'compile_cpu_time', 0.0)
+    try:
+        with timings.phase('render'):
+            _render(env, file_name, output, data, jobs, page_files, timings)
+    finally:
+        compile_time = getattr(env, 'compile_time', 0.0) - compile_time
+        compile_cpu_time = (
+            getattr(env, 'compile_cpu_time', 0.0) - compile_cpu_time)
+        timings.add('render', -compile_time, -compile_cpu_time)
+        timings.add('template compile', compile_time, compile_cpu_time)
+
+def _render(env, file_name, output, data, jobs, page_files, timings):
     template = env.get_template(os.path.basename(file_name))
-    template.stream(entities=data).dump(output)
 
-def main(args, stdin, stdout, script):
-    args = parse_args(args)
+    if (jobs < 2 and page_files is None) or not hasattr(env, 'pages'):
+        template.stream(entities=data).dump(output)
+        return
+
+    env.pages.deferred = []
+    try:
+        text = template.render(entities=data)
+    finally:
+        pages = env.pages.deferred
+        env.pages.deferred = None
+    entities = [entity for _, entity in pages]
+    timings.count('pages', len(pages))
+    if page_files is None:
+        pages = render_pages(pages, jobs, timings.trace)
+        timings.count('pages rendered', len(pages))
+    else:
+        stale = page_files.stale(entities)
+        rendered = dict(zip(
+            stale,
+            render_pages([pages[n] for n in stale], jobs, timings.trace)))
+        timings.count('pages rendered', len(rendered))
+        with timings.phase('write'):
+            pages = [
+                page_files(entity, rendered.get(n))
+                for n, entity in enumerate(entities)]
+    with timings.phase('write'):
+        output.write(
+            _page_pattern.sub(lambda m: pages[int(m.group(1))], text))
+
+def build_model(index, data_dir=None, sources=None):
+    """Builds the model from Doxygen XML.
+
+    index is the path to the index file or a file object; data_dir defaults
+    to the directory of the index file, or to the current directory. Every
+    call produces an independent Index.
+    """
+    if isinstance(index, str):
+        data_dir = data_dir or os.path.dirname(index)
+        with open(index, 'r', encoding='utf-8') as file:
+            refs = list(collect_compound_refs(file))
+    else:
+        data_dir = data_dir or os.getcwd()
+        refs = list(collect_compound_refs(index))
+    return collect_data(data_dir, refs, sources)
+
+def render_model(
+        model,
+        output=None,
+        config=None,
+        template=None,
+        includes=(),
+        extensions=(),
+        jobs=1,
+        session=None):
+    """Renders the model with a template.
+
+    The result is written into file object output, or returned as a string
+    if output is None. config is a dictionary that is completed with the same
+    defaults that apply to configuration files. template defaults to the
+    QuickBook template. A Session passed as session keeps the environment
+    with its compiled templates and extensions for later calls with the same
+    arguments; otherwise every call uses its own environment and extensions.
+    """
+    import argparse
+    session = session or Session()
+    include_dir = docca_include_dir(__file__)
+    template = template or os.path.join(include_dir, 'docca/quickbook.jinja2')
+    args = argparse.Namespace(
+        include=list(includes),
+        bundle=None,
+        extension=list(extensions),
+        cache_dir=None)
+    env = session.environment(
+        template, include_dir, args, make_config(config or dict()), dict())
+
+    file = io.StringIO() if output is None else output
+    render(env, template, file, model, jobs, timings=Timings(session.trace))
+    if output is None:
+        return file.getvalue()
+
+class _TimedPhase():
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.timings.phases.setdefault(self.name, [0.0, 0.0])
+        self.timings._stack.append([0.0, 0.0])
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.start_cpu
+        nested_wall, nested_cpu = self.timings._stack.pop()
+        self.timings.add(self.name, wall - nested_wall, cpu - nested_cpu)
+        if self.timings.trace is not None:
+            self.timings.trace.add(
+                self.name, 'phase', self.start, self.start + wall)
+        if self.timings._stack:
+            self.timings._stack[-1][0] += wall
+            self.timings._stack[-1][1] += cpu
+
+class Timings():
+    # wall and CPU time spent in each phase of a run, in the order phases
+    # were first entered, and counts of what was processed; time spent in a
+    # nested phase is only attributed to that phase; phases and other events
+    # of the run are also recorded in trace, if there is one
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.phases = dict()
+        self.counts = dict()
+        self._stack = []
+
+    def phase(self, name):
+        return _TimedPhase(self, name)
+
+    def add(self, name, wall, cpu):
+        phase = self.phases.setdefault(name, [0.0, 0.0])
+        phase[0] += wall
+        phase[1] += cpu
+
+    def count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self):
+        return dict(
+            phases=[
+                dict(name=name, wall=wall, cpu=cpu)
+                for name, (wall, cpu) in self.phases.items()],
+            total=dict(
+                wall=sum(wall for wall, _ in self.phases.values()),
+                cpu=sum(cpu for _, cpu in self.phases.values())),
+            counts=self.counts)
+
+    def report(self, file, format='text'):
+        import json
+        result = self.as_dict()
+        if format == 'json':
+            file.write(json.dumps(result, sort_keys=True) + '\n')
+            return
+
+        rows = [(p['name'], p['wall'], p['cpu']) for p in result['phases']]
+        rows.append(('total', result['total']['wall'], result['total']['cpu']))
+        lines = ['docca: timings (ms)      wall        cpu']
+        lines.extend(
+            '  %-20s %10.1f %10.1f' % (name, wall * 1000, cpu * 1000)
+            for name, wall, cpu in rows)
+        lines.extend(
+            '  %-20s %10d' % (name, n) for name, n in self.counts.items())
+        file.write('\n'.join(lines) + '\n')
+
+class RenderProfile():
+    # while active, records the number of calls of each macro, their
+    # inclusive time (recursive calls are not counted twice), and their
+    # exclusive time (without the time of macros they called); for calls of
+    # entity_macro it also records the time and size of output of each
+    # entity, without the entities nested in it
+    def __init__(self, entity_macro='write_entity'):
+        self.entity_macro = entity_macro
+        self.macros = dict()
+        self.entities = dict()
+        self._calls = []
+        self._entities = []
+        self._active = dict()
+        self._invoke = None
+
+    def __enter__(self):
+        import jinja2
+        self._invoke = jinja2.runtime.Macro._invoke
+        invoke = self._invoke
+        def profiled_invoke(macro, arguments, autoescape):
+            return self._call(invoke, macro, arguments, autoescape)
+        jinja2.runtime.Macro._invoke = profiled_invoke
+        return self
 
-    file, ctx, data_dir = open_input(stdin, args, os.getcwd())
-    with ctx:
-        refs = list(collect_compound_refs(file))
-    data = collect_data(data_dir, refs)
+    def __exit__(self, exc_type, exc_value, traceback):
+        import jinja2
+        jinja2.runtime.Macro._invoke = self._invoke
+
+    def _call(self, invoke, macro, arguments, autoescape):
+        # bodies of call blocks are anonymous macros
+        name = macro.name or 'caller'
+        is_entity = name == self.entity_macro and len(arguments) > 0
+        frame = [0.0]
+        self._calls.append(frame)
+        if is_entity:
+            entity_frame = [0.0, 0]
+            self._entities.append(entity_frame)
+        self._active[name] = self._active.get(name, 0) + 1
+        result = ''
+        start = time.perf_counter()
+        try:
+            result = invoke(macro, arguments, autoescape)
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            self._calls.pop()
+            self._active[name] -= 1
+            stats = self.macros.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            if not self._active[name]:
+                stats[1] += elapsed
+            stats[2] += elapsed - frame[0]
+            if self._calls:
+                self._calls[-1][0] += elapsed
+
+            if is_entity:
+                self._entities.pop()
+                size = len(str(result))
+                stats = self.entities.setdefault(
+                    _entity_name(arguments[0]), [0.0, 0])
+                stats[0] += elapsed - entity_frame[0]
+                stats[1] += size - entity_frame[1]
+                if self._entities:
+                    self._entities[-1][0] += elapsed
+                    self._entities[-1][1] += size
+
+    def report(self, file, top=20):
+        lines = [
+            'docca: render profile (ms)      calls  inclusive  exclusive']
+        lines.extend(
+            '  %-28s %8d %10.1f %10.1f' % (
+                name, calls, inclusive * 1000, exclusive * 1000)
+            for name, (calls, inclusive, exclusive) in sorted(
+                self.macros.items(), key=lambda x: -x[1][2]))
+        lines.append(
+            'docca: %s most expensive entities (ms)       bytes' % top)
+        lines.extend(
+            '  %-37s %10.1f %10d' % (name, elapsed * 1000, size)
+            for name, (elapsed, size) in sorted(
+                self.entities.items(), key=lambda x: -x[1][0])[:top])
+        file.write('\n'.join(lines) + '\n')
+
+class _TraceEvent():
+    def __init__(self, trace, name, category):
+        self.trace = trace
+        self.name = name
+        self.category = category
 
-    config = load_configs(args)
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.trace.add(
+            self.name, self.category, self.start, time.perf_counter())
+
+class Trace():
+    # complete events in Chrome trace event format; all events belong to the
+    # process that started the trace, and events recorded by forked worker
+    # processes are put in a separate lane for each worker
+    def __init__(self):
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        self.events = []
+
+    def event(self, name, category):
+        return _TraceEvent(self, name, category)
+
+    def add(self, name, category, start, end):
+        self.events.append(dict(
+            name=name,
+            cat=category,
+            ph='X',
+            ts=round((start - self.start) * 1e6, 3),
+            dur=round((end - start) * 1e6, 3),
+            pid=self.pid,
+            tid=os.getpid()))
+
+    def separately(self, function, *args):
+        # returns the result of function, and events it recorded, which are
+        # not added to this trace
+        events, self.events = self.events, []
+        try:
+            return function(*args), self.events
+        finally:
+            self.events = events
+
+    def merge(self, results):
+        # adds events from results of separately, and returns their results
+        for _, events in results:
+            self.events.extend(events)
+        return [result for result, _ in results]
+
+    def save(self, path):
+        import json
+        lanes = sorted(set(event['tid'] for event in self.events))
+        metadata = [
+            dict(
+                name='process_name', ph='M', pid=self.pid, tid=self.pid,
+                args=dict(name='docca'))
+        ]
+        metadata.extend(
+            dict(
+                name='thread_name', ph='M', pid=self.pid, tid=tid,
+                args=dict(
+                    name='main' if tid == self.pid else 'worker %s' % tid))
+            for tid in lanes)
+        with AtomicFile(path) as file:
+            json.dump(
+                dict(traceEvents=metadata + self.events, displayTimeUnit='ms'),
+                file)
+
+def traced(trace, name, category):
+    # an event of trace, if there is one
+    if trace is None:
+        return Nullcontext()
+    return trace.event(name, category)
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class Session():
+    # keeps template environments with their extensions, parsed compound
+    # files, and models between runs, so that a run only pays for what has
+    # changed since the previous one; runs record events in trace, if there
+    # is one
+    def __init__(self):
+        self.trace = None
+        self._environments = dict()
+        self._compounds = dict()
+        self._models = dict()
+
+    def read_compound(self, file_name):
+        signature = file_signature(file_name)
+        cached = self._compounds.get(file_name)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        result = read_compound(file_name, self.trace)
+        self._compounds[file_name] = (signature, result)
+        return result
+
+    def environment(
+            self, template, include_dir, args, config, environ,
+            timings=None):
+        import json
+        timings = timings or Timings(self.trace)
+        cache_dir = cache_directory(args, environ)
+        key = (
+            template,
+            include_dir,
+            tuple(args.include),
+            args.bundle,
+            cache_dir,
+            tuple((ext, file_signature(ext)) for ext in args.extension),
+            # extensions may change the configuration when they are
+            # installed, so an environment is only reused for the same one
+            json.dumps(config, sort_keys=True),
+        )
+        env = self._environments.get(key)
+        if env is not None:
+            env.trace = self.trace
+            return env
+
+        with timings.phase('extensions'):
+            exts = load_extensions(args.extension, self.trace)
+        with timings.phase('environment'):
+            bytecode_cache = None
+            if cache_dir:
+                bytecode_cache = _defined('BytecodeCache')(
+                    cache_dir, args.extension)
+            env = construct_environment(
+                template_loader(template, include_dir, args),
+                config,
+                bytecode_cache)
+        env.trace = self.trace
+        with timings.phase('extensions'):
+            env = install_extensions(env, exts, self.trace)
+        self._environments[key] = env
+        return env
+
+    def model(self, data_dir, refs, incremental=False, timings=None):
+        data_dir = os.path.abspath(data_dir)
+        files = [os.path.join(data_dir, refid) + '.xml' for refid in refs]
+        signature = (
+            tuple(refs), tuple(file_signature(file) for file in files))
+        cached = self._models.get(data_dir)
+        if (cached is not None
+                and cached[0] == signature
+                and (cached[2] is not None or not incremental)):
+            return cached[1], cached[2]
+
+        timings = timings or Timings(self.trace)
+        def read(file_name):
+            data, root = self.read_compound(file_name)
+            timings.count('XML bytes', len(data))
+            return data, root
+
+        sources = SourceFiles() if incremental else None
+        data = collect_data(data_dir, refs, sources, read, timings)
+        self._models[data_dir] = (signature, data, sources)
+
+        files = set(files)
+        for file_name in list(self._compounds):
+            if (os.path.dirname(file_name) == data_dir
+                    and file_name not in files):
+                del self._compounds[file_name]
+        return data, sources
+
+    def main(self, args, stdin, stdout, script, environ=os.environ):
+        args = parse_args(args)
+        if not args.trace:
+            return self.run(args, stdin, stdout, script, environ)
+
+        previous, self.trace = self.trace, Trace()
+        try:
+            return self.run(args, stdin, stdout, script, environ)
+        finally:
+            trace, self.trace = self.trace, previous
+            trace.save(args.trace)
+
+    def run(self, args, stdin, stdout, script, environ=os.environ):
+        timings = Timings(self.trace)
+
+        with timings.phase('config'):
+            config = load_configs(args)
 
-    file, ctx = open_output(stdout, args)
-    with ctx:
         include_dir = docca_include_dir(script)
         template = template_file_name(include_dir, args)
 
-        include_dirs = collect_include_dirs(template, include_dir, args)
+        env = self.environment(
+            template, include_dir, args, config, environ, timings)
 
-        env = construct_environment(
-            jinja2.FileSystemLoader(include_dirs), config)
+        if args.compile_templates:
+            compile_templates(env, template, args.compile_templates)
+            return
 
-        exts = load_extensions(args.extension)
-        env = install_extensions(env, exts)
+        with timings.phase('index scan'):
+            file, ctx, data_dir = open_input(stdin, args, os.getcwd())
+            with ctx:
+                refs = list(collect_compound_refs(file))
+        timings.count('compounds', len(refs))
+        data, sources = self.model(
+            data_dir, refs, args.incremental, timings)
+
+        page_files = None
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            inputs = None
+            if args.incremental:
+                inputs = PageInputs(
+                    data, sources, environment_digest(env, args.extension))
+            page_files = PageFiles(
+                args.output_dir,
+                os.path.dirname(os.path.abspath(args.output)) if args.output
+                    else os.getcwd(),
+                inputs)
+
+        # calls made by worker processes would not be recorded
+        jobs = args.render_jobs
+        profile = Nullcontext()
+        if args.profile_render is not None:
+            jobs = 1
+            profile = RenderProfile()
+
+        # only what is not part of rendering is attributed to writing
+        with timings.phase('write'):
+            file, ctx = open_output(stdout, args)
+            with ctx, profile:
+                render(
+                    env, template, file, data, jobs, page_files, timings)
+            if page_files is not None:
+                page_files.save_manifest()
+        if args.output:
+            timings.count('output bytes', os.path.getsize(args.output))
+
+        if args.output:
+            status = '%s %s' % (
+                args.output, 'updated' if ctx.changed else 'unchanged')
+            if page_files is not None:
+                status += '; pages: %s updated, %s unchanged, %s reused' % (
+                    len(page_files.written),
+                    len(page_files.unchanged),
+                    len(page_files.reused))
+            print('docca: ' + status, file=sys.stderr)
+        if args.timings:
+            timings.report(sys.stderr, args.timings)
+        if args.profile_render is not None:
+            profile.report(sys.stderr, args.profile_render)
+
+    def handle(self, request, script):
+        import contextlib
+        import traceback
+        # runs a request from a client in the client's working directory, and
+        # returns what the run has written into STDOUT and STDERR
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        status = 0
+        cwd = os.getcwd()
+        try:
+            os.chdir(request['cwd'])
+            with contextlib.redirect_stderr(stderr):
+                self.main(
+                    request['argv'],
+                    io.StringIO(request.get('stdin') or ''),
+                    stdout,
+                    script,
+                    request.get('environ', dict()))
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc(file=stderr)
+            status = 1
+        finally:
+            os.chdir(cwd)
+        return dict(
+            status=status, stdout=stdout.getvalue(), stderr=stderr.getvalue())
+
+    def job(self, argv, script):
+        # runs a batch job; events it records are returned with its result
+        # rather than added to trace, as it may run in a worker process
+        if self.trace is None:
+            return self._job(argv, script)
+        return self.trace.separately(self._job, argv, script)
+
+    def _job(self, argv, script):
+        start = time.perf_counter()
+        with traced(self.trace, argv[argv.index('--output') + 1], 'job'):
+            result = self.handle(dict(argv=argv, cwd=os.getcwd()), script)
+        result['time'] = time.perf_counter() - start
+        return result
 
-        render(env, template, file, data)
+_daemon_environ = ('DOCCA_CACHE_DIR',)
+
+def _define_daemon_handler():
+    import json
+    import socketserver
+    class DaemonHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.read().decode('utf-8'))
+            response = self.server.session.handle(request, self.server.script)
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+    return DaemonHandler
+
+_class_factories['DaemonHandler'] = _define_daemon_handler
+
+def _define_daemon():
+    import socket
+    import socketserver
+    class Daemon(socketserver.UnixStreamServer):
+        # serves requests one at a time, as they change the working directory
+        def __init__(self, path, script, session=None):
+            if os.path.exists(path):
+                # a socket left by a daemon that was killed
+                try:
+                    with socket.socket(socket.AF_UNIX) as probe:
+                        probe.connect(path)
+                except ConnectionRefusedError:
+                    os.remove(path)
+                else:
+                    raise RuntimeError(
+                        'Daemon is already listening on %s' % path)
+
+            super().__init__(path, _defined('DaemonHandler'))
+            self.path = path
+            self.script = script
+            self.session = session or Session()
+
+        def server_bind(self):
+            super().server_bind()
+            # requests run docca with the daemon's permissions, so only its
+            # user may connect; done before the socket starts listening
+            os.chmod(self.server_address, 0o600)
+
+        def server_close(self):
+            super().server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+    return Daemon
+
+_class_factories['Daemon'] = _define_daemon
+
+def serve(path, script):
+    import socket
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError('Daemon mode requires Unix sockets')
+    with _defined('Daemon')(path, script) as daemon:
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+def connect(path, argv, stdin, stdout, stderr, environ=os.environ):
+    import json
+    import socket
+    args = parse_args(argv)
+    request = dict(
+        argv=argv,
+        cwd=os.getcwd(),
+        environ={
+            key: environ[key] for key in _daemon_environ if key in environ},
+    )
+    if not args.input and not args.compile_templates:
+        request['stdin'] = stdin.read()
+
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as file:
+            response = json.loads(file.read().decode('utf-8'))
+
+    stdout.write(response['stdout'])
+    stderr.write(response['stderr'])
+    return response['status']
+
+_batch_paths = (
+    'input', 'output', 'output_dir', 'config', 'template', 'include',
+    'extension', 'directory', 'cache_dir', 'bundle', 'trace')
+
+def batch_arguments(job, base):
+    import json
+    # converts a job from a batch file into command line arguments; relative
+    # paths are relative to the batch file
+    if not job.get('output'):
+        raise RuntimeError('Batch job %s has no output' % json.dumps(job))
+
+    result = ['docca']
+    for key, value in job.items():
+        option = '--' + key.replace('_', '-')
+        if isinstance(value, bool):
+            if value:
+                result.append(option)
+            continue
+        for item in (value if isinstance(value, list) else [value]):
+            item = str(item)
+            if key in _batch_paths:
+                item = os.path.join(base, item)
+            result += [option, item]
+    return result
+
+def run_batch(file_name, workers, script, stderr, trace=None):
+    session = Session()
+    if not trace:
+        return _run_batch(session, file_name, workers, script, stderr)
+
+    session.trace = Trace()
+    try:
+        return _run_batch(session, file_name, workers, script, stderr)
+    finally:
+        session.trace.save(trace)
+
+def _run_batch(session, file_name, workers, script, stderr):
+    import json
+    import multiprocessing
+    import traceback
+    # jobs that use the same templates share an environment, which is set up
+    # before worker processes are forked, so that they get it compiled
+    start = time.perf_counter()
+    with open(file_name, 'r', encoding='utf-8') as file:
+        jobs = json.load(file)
+    base = os.path.dirname(os.path.abspath(file_name))
+    jobs = [batch_arguments(job, base) for job in jobs]
+
+    # a job that cannot be set up fails without affecting others
+    include_dir = docca_include_dir(script)
+    results = [None] * len(jobs)
+    for n, argv in enumerate(jobs):
+        try:
+            args = parse_args(argv)
+            template = template_file_name(include_dir, args)
+            env = session.environment(
+                template, include_dir, args, load_configs(args), os.environ)
+            env.get_template(os.path.basename(template))
+        except SystemExit:
+            results[n] = dict(status=1, stdout='', stderr='')
+        except Exception:
+            results[n] = dict(
+                status=1, stdout='', stderr=traceback.format_exc())
+    pending = [n for n, result in enumerate(results) if result is None]
+
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        workers = 1
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+
+    if workers < 2:
+        ran = [session.job(jobs[n], script) for n in pending]
+    else:
+        with context.Pool(workers, _start_worker, (session.job,)) as pool:
+            ran = pool.starmap(
+                _run_task,
+                [(jobs[n], script) for n in pending],
+                chunksize=1)
+    if session.trace is not None:
+        ran = session.trace.merge(ran)
+    for n, result in zip(pending, ran):
+        results[n] = result
+
+    failed = 0
+    for argv, result in zip(jobs, results):
+        stderr.write(result['stderr'])
+        if result['status']:
+            failed += 1
+            print(
+                'docca: job for %s failed' % argv[argv.index('--output') + 1],
+                file=stderr)
+    print(
+        'docca: %s jobs, %s failed, %.2f s' % (
+            len(jobs), failed, time.perf_counter() - start),
+        file=stderr)
+    return 1 if failed else 0
+
+def watched_files(args, script):
+    # the XML, configuration, template, and extension files that a run with
+    # args depends on, mapped to their signatures
+    include_dir = docca_include_dir(script)
+    template = template_file_name(include_dir, args)
+    data_dir = args.directory or os.path.dirname(args.input) or os.curdir
+
+    files = [args.input] + args.config + args.extension
+    files += [
+        os.path.join(data_dir, name)
+        for name in os.listdir(data_dir) if name.endswith('.xml')]
+    directories = [args.bundle] if args.bundle else collect_include_dirs(
+        template, include_dir, args)
+    for directory in directories:
+        if os.path.isfile(directory):
+            files.append(directory)
+        for root, _, names in os.walk(directory):
+            files.extend(os.path.join(root, name) for name in names)
+    return {
+        os.path.abspath(file): file_signature(file) for file in files}
+
+def watch(argv, script, stderr, interval=0.5, runs=None):
+    # renders again whenever one of the watched files changes; the session
+    # only parses changed XML files again and reuses the environment unless
+    # extensions have changed
+    args = parse_args(argv)
+    session = Session()
+    files = None
+    while runs is None or runs > 0:
+        try:
+            current = watched_files(args, script)
+        except FileNotFoundError:
+            # the first run reports what is missing; afterwards files that
+            # vanish while they are listed are picked up by the next poll
+            if files is not None:
+                time.sleep(interval)
+                continue
+            current = dict()
+        if current == files:
+            time.sleep(interval)
+            continue
+
+        if files is not None:
+            changed = sorted(
+                file for file in set(current) | set(files)
+                if current.get(file) != files.get(file))
+            print(
+                'docca: %s changed' % ', '.join(
+                    os.path.relpath(file) for file in changed),
+                file=stderr)
+        files = current
+
+        start = time.perf_counter()
+        result = session.handle(dict(argv=argv, cwd=os.getcwd()), script)
+        stderr.write(result['stderr'])
+        print(
+            'docca: %s in %.2f s, watching %s files' % (
+                'failed' if result['status'] else 'rendered',
+                time.perf_counter() - start,
+                len(files)),
+            file=stderr)
+        stderr.flush()
+        if runs is not None:
+            runs -= 1
+
+def main(args, stdin, stdout, script):
+    parsed = parse_args(args)
+    if parsed.watch:
+        try:
+            return watch(args, script, sys.stderr, parsed.watch_interval)
+        except KeyboardInterrupt:
+            return
+    if parsed.batch:
+        return run_batch(
+            parsed.batch, parsed.batch_workers, script, sys.stderr,
+            parsed.trace)
+    if parsed.daemon:
+        return serve(parsed.daemon, script)
+    if parsed.connect:
+        return connect(parsed.connect, args, stdin, stdout, sys.stderr)
+    return Session().main(args, stdin, stdout, script)
 
 if __name__ == '__main__':
-    main(sys.argv, sys.stdin, sys.stdout, os.path.realpath(__file__))
+    sys.exit(main(sys.argv, sys.stdin, sys.stdout, os.path.realpath(__file__)))
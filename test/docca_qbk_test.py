@@ -12,6 +12,7 @@ import io
 import jinja2
 import os
 import pytest
+import re
 import textwrap
 
 from docca_test_helpers import make_elem
@@ -584,6 +585,7 @@ def test_abridged_fqn(entities, cfg, render):
 
 def test_phrase(entities, cfg, render):
     cfg['external_marker'] = '!!!'
+    assert entities['ostream'].external_url == 'http://ostream.org'
     render.template = '''
         {%- import "docca/quickbook/components.jinja2" as qbk -%}
         {{ qbk.phrase(entities) }}'''
@@ -966,12 +968,13 @@ def test_function_summary_table(entities, render):
     render.template = '''\
         {%- import "docca/quickbook/components.jinja2" as qbk -%}
         {{ qbk.function_summary_table(entities, 'T') }}'''
-    assert render([
+    # tables list members in the given order, which sorted_member_group sorts
+    assert render(sorted([
             entities['cl1_c'].overload_set,
             entities['cl1_d'].overload_set,
             entities['o[]'].overload_set,
             entities['g1'].overload_set,
-        ]) == textwrap.dedent('''\
+        ])) == textwrap.dedent('''\
             [heading T]
             [table [[Name][Description]]
               [
@@ -1508,3 +1511,177 @@ def test_defaulted(cfg, render):
     assert render(func) == textwrap.dedent('''\
         void
         func() = default;''')
+
+def test_markup_matches_macros(cfg, entities):
+    loader = jinja2.ChoiceLoader([
+        jinja2.FileSystemLoader(os.path.dirname(__file__)),
+        jinja2.DictLoader({
+            'macro': '''\
+                {%- import "markup_reference.jinja2" as ref -%}
+                {{ ref[entities[0]](entities[1], **entities[2]) }}''',
+            'filter': '''\
+                {%- set name, obj, kw = entities -%}
+                {%- if name == 'description' -%}{{ obj | description(**kw) }}
+                {%- elif name == 'phrase' -%}{{ obj | phrase(**kw) }}
+                {%- elif name == 'phrase_part' -%}{{ obj | phrase_part(**kw) }}
+                {%- elif name == 'itemised' -%}{{ obj | itemised(**kw) }}
+                {%- elif name == 'table' -%}{{ obj | table(**kw) }}
+                {%- elif name == 'parameter_list' -%}
+                    {{- obj | parameter_list(**kw) -}}
+                {%- elif name == 'subsection' -%}{{ obj | subsection(**kw) }}
+                {%- endif -%}''',
+        }),
+    ])
+    env = docca.construct_environment(loader, cfg)
+
+    def params(kind, description):
+        return docca.ParameterList(
+            kind,
+            [
+                docca.ParameterDescription(
+                    description,
+                    [
+                        docca.ParameterItem(
+                            docca.Phrase(['int']), docca.Phrase(['a']), None),
+                        docca.ParameterItem(
+                            None,
+                            docca.Phrase([
+                                docca.EntityRef(entities['cl1'], ['b'])]),
+                            None),
+                    ]),
+                docca.ParameterDescription(docca.Paragraph([]), []),
+            ])
+
+    phrase = docca.Phrase([
+        'text [with] brackets ',
+        docca.Monospaced(['mono  &']),
+        docca.Emphasised(['emph ', docca.Strong(['bold'])]),
+        docca.Linebreak(),
+        docca.UrlLink('http://a.b/c', ['link text']),
+        docca.EmDash(),
+        docca.EntityRef(entities['g1'], ['ref text']),
+        docca.EntityRef(entities['ostream'], ['output stream']),
+        docca.EntityRef(entities['e1_a'], ['enumerator']),
+        docca.EnDash(),
+        docca.Phrase(['const  T  &&...']),
+    ])
+    itemised = docca.List(
+        '1',
+        [
+            docca.ListItem([
+                docca.Paragraph(['o1']),
+                docca.List(None, [docca.ListItem([docca.Paragraph(['u'])])]),
+            ]),
+            docca.ListItem([
+                docca.CodeBlock([docca.CodeLine('int i;', [(0, 3, 'k')])]),
+            ]),
+        ])
+    table = docca.Table(
+        2,
+        [[docca.Cell([docca.Paragraph([phrase])]), docca.Cell([itemised])]],
+        caption=docca.Paragraph(['Caption']))
+    sections = [
+        docca.Section(kind, None, [docca.Paragraph([phrase])])
+        for kind in ('see', 'return', 'note', 'par', 'unknown', None)
+    ]
+    sections.append(docca.Section(
+        None, docca.Paragraph(['Title']), [itemised]))
+    parameter_lists = [
+        params(kind, [docca.Paragraph(['described'])])
+        for kind in ('param', 'templateparam', 'exception', 'retval')
+    ]
+    blocks = [docca.Paragraph([phrase]), itemised, table]
+    blocks += sections + parameter_lists
+
+    samples = [
+        ('description', blocks, {}),
+        ('description', blocks, dict(nesting='  ', title='Title')),
+        ('description', parameter_lists, dict(title='Title')),
+        ('description', [], dict(title='Title')),
+        ('itemised', itemised, dict(nesting='   ')),
+        ('table', table, {}),
+        ('phrase_part', 'a [b]', {}),
+        ('phrase_part', 'const  int  *', dict(in_code=True)),
+        ('phrase_part', '', dict(in_code=True)),
+    ]
+    samples += [('subsection', section, {}) for section in sections]
+    samples += [('parameter_list', params, {}) for params in parameter_lists]
+    for entity in entities.values():
+        samples.append(('description', entity.brief, {}))
+        samples.append(('description', entity.description, {}))
+        for attr in ('return_type', 'type', 'value', 'aliased'):
+            value = getattr(entity, attr, None)
+            if isinstance(value, docca.Phrase):
+                samples.append(('phrase', value, {}))
+                samples.append(('phrase', value, dict(in_code=True)))
+    for in_code in (False, True):
+        samples.append(('phrase', phrase, dict(in_code=in_code)))
+        samples += [
+            ('phrase_part', part, dict(in_code=in_code)) for part in phrase]
+
+    configs = [
+        dict(),
+        dict(legacy_behavior=True),
+        dict(
+            external_marker='!!!',
+            link_prefix='a.b.',
+            default_namespace='ns1',
+            replace_strings={'T': 'U', '\\bint\\b': 'Int'}),
+        dict(legacy_behavior=True, replace_strings={'(c)onst': '\\1ONST'}),
+    ]
+    for config in configs:
+        cfg.update(config)
+        for sample in samples:
+            expected = io.StringIO()
+            docca.render(env, 'macro', expected, sample)
+            result = io.StringIO()
+            docca.render(env, 'filter', result, sample)
+            assert result.getvalue() == expected.getvalue(), sample
+
+def test_render_jobs(cfg, entities, render):
+    render.template = '{% include "docca/quickbook.jinja2" %}'
+    expected = render(entities)
+    assert expected
+
+    for jobs in (2, 3):
+        file = io.StringIO()
+        docca.render(render.env, '__tmpl__', file, entities, jobs)
+        assert file.getvalue() == expected
+
+def test_page_files(cfg, entities, render, tmpdir):
+    render.template = '{% include "docca/quickbook.jinja2" %}'
+    expected = render(entities)
+
+    pages_dir = os.path.join(tmpdir, 'pages')
+    os.mkdir(pages_dir)
+    for jobs in (1, 2):
+        page_files = docca.PageFiles(pages_dir, tmpdir)
+        file = io.StringIO()
+        docca.render(render.env, '__tmpl__', file, entities, jobs, page_files)
+        result = file.getvalue()
+
+        includes = re.findall(r'\[include (pages/[^\]]+)\]', result)
+        assert includes
+        assert 'pages/ns1__ns2__klass.qbk' in includes
+        paths = [os.path.join(tmpdir, *p.split('/')) for p in includes]
+        if jobs == 1:
+            assert page_files.written == paths
+        else:
+            assert page_files.unchanged == paths
+
+        def contents(match):
+            with open(os.path.join(tmpdir, match.group(1))) as file:
+                return file.read()
+        result = re.sub(r'\[include ([^\]]+)\]', contents, result)
+        def squeeze(s):
+            return re.sub('\n+', '\n', s).strip()
+        assert squeeze(result) == squeeze(expected)
+
+def test_page_file_names(tmpdir):
+    page_files = docca.PageFiles(tmpdir)
+    class Fake():
+        def __init__(self, name):
+            self._links = {(False, ''): name}
+    assert page_files.file_name(Fake('ns__A')) == 'ns__A.qbk'
+    assert page_files.file_name(Fake('ns__a')) == 'ns__a_2.qbk'
+    assert page_files.file_name(Fake('ns__b')) == 'ns__b.qbk'
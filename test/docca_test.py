@@ -10,16 +10,28 @@
 import argparse
 import contextlib
 import docca
+import gc
 import io
 import jinja2
 import jinja2.ext
+import json
 import os
 import pytest
 import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
 import types
+import xml.etree.ElementTree as ET
+import zipfile
 
 from docca_test_helpers import (
+    DoxygenXml,
     MockXmlElem,
+    doxygen_xml,
     make_elem,
 )
 
@@ -159,6 +171,60 @@ def test_blocks():
     assert len(blocks[0]) == 2
     assert blocks[0][0] == 'int n = 0;'
     assert blocks[0][1] == 'int m = 0;'
+    assert blocks[0].formatted() == 'int n = 0;\nint m = 0;\n'
+    assert blocks[0].formatted('  ') == '  int n = 0;\n  int m = 0;\n'
+
+    blocks = docca.make_blocks(
+        make_elem({'items': [
+            {
+                'tag': 'programlisting',
+                'items': [
+                    {
+                        'tag': 'codeline',
+                        'items': [
+                            {
+                                'tag': 'highlight',
+                                'class': 'keyword',
+                                'items': ['auto'],
+                            },
+                            {
+                                'tag': 'highlight',
+                                'class': 'normal',
+                                'items': [
+                                    { 'tag': 'sp' },
+                                    { 'tag': 'ref', 'items': ['x'] },
+                                    { 'tag': 'sp' },
+                                    '=',
+                                    { 'tag': 'sp' },
+                                ],
+                            },
+                            ' ',
+                            {
+                                'tag': 'highlight',
+                                'class': 'stringliteral',
+                                'items': ['"s"'],
+                            },
+                            {
+                                'tag': 'highlight',
+                                'class': 'normal',
+                                'items': [';'],
+                            },
+                        ],
+                    },
+                    { 'tag': 'codeline' },
+                ]
+            },
+        ]}),
+        None)
+    assert blocks[0][0] == 'auto x =  "s";'
+    assert blocks[0][0].spans == (
+        (0, 4, 'keyword'),
+        (4, 9, 'normal'),
+        (10, 13, 'stringliteral'),
+        (13, 14, 'normal'),
+    )
+    assert blocks[0][1] == ''
+    assert blocks[0][1].spans == ()
 
     blocks = docca.make_blocks(
         make_elem({'items': [
@@ -525,6 +591,47 @@ def test_phrases():
     assert isinstance(p, docca.EnDash)
     assert p.text == '\u2013'
 
+    lb = docca.Linebreak()
+    p = docca.Phrase(['a', '', 'b', lb, '', 'c', 'd', ''])
+    assert len(p) == 3
+    assert p[0] == 'ab'
+    assert p[1] is lb
+    assert p[2] == 'cd'
+    assert p.text == 'abcd'
+    with pytest.raises(TypeError):
+        p[0] = 'x'
+
+    p = docca.make_phrase(
+        make_elem({
+            'tag': 'bold',
+            'items': [
+                'a',
+                { 'tag': 'linebreak' },
+                '\n',
+                { 'tag': 'linebreak' },
+                'b',
+            ],
+        }),
+        None)
+    assert len(p) == 4
+    assert isinstance(p[1], docca.Linebreak)
+    assert isinstance(p[2], docca.Linebreak)
+
+    p = docca.Phrase(['int(&)', lb])
+    q = p.with_part(0, 'int')
+    assert isinstance(q, docca.Phrase)
+    assert q.text == 'int'
+    assert q[1] is lb
+    assert p.text == 'int(&)'
+
+    p = docca.Phrase(['const\n  int ', docca.Strong(['&'])])
+    assert p.code_text == 'const int&'
+    assert p.code_text is p.code_text
+    assert docca.Phrase(['T &&...']).code_text == 'T&&...'
+    assert docca.Phrase(['T  *']).code_text == 'T*'
+    assert docca.Phrase([]).code_text == ''
+    assert docca.normalize_code_text(' a' * 40) == ' a' * 32 + ' a' * 8
+
 def test_namespace():
     ns = docca.Namespace(
         make_elem({
@@ -645,6 +752,41 @@ def test_namespace():
     assert ns2.lookup('OtherNs') == ns
     assert ns2.lookup('OtherNs::MyClass') == c
 
+    def variable(id, name):
+        return dict(
+            tag='memberdef',
+            kind='variable',
+            id=id,
+            items=[
+                { 'tag': 'name', 'items': [name] },
+                { 'tag': 'type', 'items': ['int'] },
+            ])
+
+    index = dict()
+    ns = docca.Namespace(
+        make_elem({
+            'tag': 'compound',
+            'id': 'ns3',
+            'items': [
+                { 'tag': 'compoundname', 'items': ['VarNs'] },
+                {
+                    'tag': 'sectiondef',
+                    'items': [variable('v1', 'b'), variable('v2', 'a')],
+                },
+            ]
+        }),
+        index)
+    for entity in index.values():
+        entity.resolve_references()
+    b, a = index['v1'], index['v2']
+    assert ns.member_group('variables', 'public', 'nonstatic') == [b, a]
+    assert ns.sorted_member_group('variables', 'public', 'nonstatic') \
+        == [a, b]
+    assert ns.sorted_member_group('types', 'public') == []
+    assert ns.sorted_members('variables') == [a, b]
+    assert ns.sorted_members('variables') is ns.sorted_members('variables')
+    assert ns.sorted_members('functions') == []
+
 def test_class():
     for Kind in (docca.Union, docca.Struct, docca.Class):
         c = Kind(
@@ -760,6 +902,46 @@ def test_class():
     assert d.bases[2].is_virtual
     assert d.bases[2].base.text == 'external::type'
 
+    def variable(id, name, **kw):
+        return dict(
+            tag='memberdef',
+            kind='variable',
+            id=id,
+            items=[
+                { 'tag': 'name', 'items': [name] },
+                { 'tag': 'type', 'items': ['int'] },
+            ],
+            **kw)
+
+    index = dict()
+    c = docca.Class(
+        make_elem({
+            'tag': 'compound',
+            'id': 'someid',
+            'items': [
+                { 'tag': 'compoundname', 'items': ['MyClass'] },
+                {
+                    'tag': 'sectiondef',
+                    'items': [
+                        variable('v1', 'b'),
+                        variable('v2', 'a'),
+                        variable('v3', 's', static='yes'),
+                        variable('v4', 'p', prot='private'),
+                    ],
+                },
+            ]
+        }),
+        index)
+    for entity in index.values():
+        entity.resolve_references()
+    b, a, s, p = (index[id] for id in ('v1', 'v2', 'v3', 'v4'))
+    assert c.member_group('variables', 'public', 'nonstatic') == [b, a]
+    assert c.sorted_member_group('variables', 'public', 'nonstatic') == [a, b]
+    assert c.member_group('variables', 'public', 'static') == [s]
+    assert c.member_group('variables', 'private', 'nonstatic') == [p]
+    assert c.member_group('types', 'public') == []
+    assert c.sorted_member_group('functions', 'public', 'friend') == []
+
 def test_enum():
     e = docca.Enum(
         make_elem({
@@ -2192,6 +2374,20 @@ def test_parse_args():
     assert args.config == ['conf4', 'conf5']
     assert args.include == ['include6', 'include7', 'include8']
     assert args.extension == ['ext10', 'ext11']
+    assert args.cache_dir is None
+
+    args = docca.parse_args(['', '--cache-dir', 'some/cache'])
+    assert args.cache_dir == 'some/cache'
+    with pytest.raises(SystemExit) as e:
+        docca.parse_args(['', '--cache-dir', 'a', '--cache-dir', 'b'])
+
+    args = docca.parse_args(['', '--compile-templates', 'out.zip'])
+    assert args.compile_templates == 'out.zip'
+    assert args.bundle is None
+
+    args = docca.parse_args(['', '--bundle', 'out.zip'])
+    assert args.compile_templates is None
+    assert args.bundle == 'out.zip'
 
 def test_open_input(tmpdir):
     stdin = io.StringIO()
@@ -2235,6 +2431,83 @@ def test_collect_compond_refs():
         list( docca.collect_compound_refs(io.StringIO(_compound_index)) )
         == [str(n) for n in range(5)])
 
+def test_shared_blocks():
+    def func(id, brief):
+        return {
+            'tag': 'memberdef',
+            'kind': 'function',
+            'id': id,
+            'items': [
+                { 'tag': 'name', 'items': ['func'] },
+                { 'tag': 'argsstring', 'items': [''] },
+                { 'tag': 'type', 'items': ['void'] },
+                { 'tag': 'briefdescription', 'items': [brief] },
+                {
+                    'tag': 'detaileddescription',
+                    'items': [
+                        {
+                            'tag': 'para',
+                            'items': [
+                                'See ',
+                                { 'tag': 'ref', 'refid': 'ns', 'items': ['ns'] },
+                                '.',
+                            ],
+                        },
+                        {
+                            'tag': 'itemizedlist',
+                            'items': [
+                                {
+                                    'tag': 'listitem',
+                                    'items': [
+                                        { 'tag': 'para', 'items': ['item'] },
+                                    ],
+                                },
+                            ],
+                        },
+                    ],
+                },
+            ],
+        }
+
+    index = docca.Index()
+    ns = docca.Namespace(
+        make_elem({
+            'tag': 'compound',
+            'id': 'ns',
+            'items': [
+                { 'tag': 'compoundname', 'items': ['ns'] },
+                {
+                    'tag': 'sectiondef',
+                    'items': [
+                        func('f1', 'Brief'),
+                        func('f2', 'Brief'),
+                        func('f3', 'Other brief'),
+                    ],
+                },
+            ]
+        }),
+        index)
+    for entity in index.values():
+        entity.resolve_references()
+
+    f1, f2, f3 = index['f1'], index['f2'], index['f3']
+    assert f1.brief is f2.brief
+    assert f1.description is f2.description
+    assert f1.brief is not f3.brief
+    assert f1.description is f3.description
+    assert f1.brief[0].text == 'Brief'
+    assert f3.brief[0].text == 'Other brief'
+    assert f1.description[0][1].entity is ns
+    assert f1.description[1][0][0].text == 'item'
+
+    with pytest.raises(TypeError):
+        f1.brief[0] = None
+    with pytest.raises(TypeError):
+        f1.description[0][0] = 'text'
+
+    assert docca.text_with_refs(None, index) is docca.text_with_refs(
+        None, index)
+
 def test_collect_data(tmpdir):
     kinds = [
         ('class', docca.Class,         'compoundname'),
@@ -2249,12 +2522,704 @@ def test_collect_data(tmpdir):
 
     refs = list( docca.collect_compound_refs(io.StringIO(_compound_index)) )
     data = docca.collect_data(tmpdir, refs)
+    assert isinstance(data, docca.Index)
     for n, kind in enumerate(kinds):
         ref = str(n)
         assert isinstance(data[ref], kind[1])
         assert data[ref].id == ref
         assert data[ref].name == 'Entity' + ref
 
+def test_source_files():
+    data = DoxygenXml.namespace.format(f='F', g='G').encode('utf-8')
+    sources = docca.SourceFiles()
+    sources.add('ns', data, ET.fromstring(data))
+    assert set(sources.hashes) == {'ns', 'ns_f', 'ns_g'}
+    assert sources.references['ns'] == {'ns_c'}
+    assert sources.references['ns_f'] == set()
+
+    other = docca.SourceFiles()
+    data = data.replace(b'G', b'H')
+    other.add('ns', data, ET.fromstring(data))
+    assert other.hashes['ns'] != sources.hashes['ns']
+    assert other.hashes['ns_f'] == sources.hashes['ns_f']
+    assert other.hashes['ns_g'] != sources.hashes['ns_g']
+
+def test_incremental(tmpdir, doxygen_xml, monkeypatch):
+    pages = os.path.join(tmpdir, 'pages')
+    output = os.path.join(tmpdir, 'out.qbk')
+    runs = []
+    class Files(docca.PageFiles):
+        def __init__(self, *args, **kw):
+            super().__init__(*args, **kw)
+            runs.append(self)
+    def run(f, g, *args):
+        doxygen_xml.write_namespace(f, g)
+        docca.main(
+            [
+                'docca', '-i', os.path.join(tmpdir, 'index.xml'),
+                '-o', output, '--output-dir', pages, '--incremental',
+            ] + list(args),
+            None,
+            None,
+            docca.__file__)
+        with open(output, 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def names(paths):
+        return [os.path.basename(path) for path in paths]
+
+    monkeypatch.setattr(docca, 'PageFiles', Files)
+    result = run('F', 'G')
+    assert result.count('[include pages/') == 3
+    assert names(runs[-1].written) == ['ns__c.qbk', 'ns__f.qbk', 'ns__g.qbk']
+
+    assert run('F', 'G') == result
+    assert len(runs[-1].reused) == 3
+    assert not runs[-1].written
+
+    # g is not referenced by anything
+    run('F', 'G2')
+    assert names(runs[-1].written) == ['ns__g.qbk']
+    assert len(runs[-1].reused) == 2
+
+    # the brief of f is used for its link
+    run('F2', 'G2')
+    assert names(runs[-1].written) == ['ns__f.qbk']
+    assert names(runs[-1].unchanged) == ['ns__c.qbk']
+
+    # configuration is an input of every page
+    config = os.path.join(tmpdir, 'config.json')
+    doxygen_xml.write('config.json', '{"link_prefix": "lib."}')
+    run('F2', 'G2', '-c', config)
+    assert len(runs[-1].written) == 1
+    assert len(runs[-1].unchanged) == 2
+    with open(os.path.join(pages, 'ns__c.qbk'), encoding='utf-8') as file:
+        assert '[link lib.ns__f' in file.read()
+
+    manifest = os.path.join(pages, docca.PageFiles.manifest_name)
+    with open(manifest, encoding='utf-8') as file:
+        assert set(json.load(file)['pages']) == {'ns_c', 'ns_f', 'ns_g'}
+
+def test_stale_pages(tmpdir, doxygen_xml):
+    pages = os.path.join(tmpdir, 'pages')
+    def run(*args):
+        docca.main(
+            [
+                'docca', '-i', os.path.join(tmpdir, 'index.xml'),
+                '-o', os.path.join(tmpdir, 'out.qbk'), '--output-dir', pages,
+            ] + list(args),
+            None,
+            None,
+            docca.__file__)
+        return sorted(os.listdir(pages))
+    def remove_g():
+        doxygen_xml.write('ns.xml', re.sub(
+            '<memberdef[^>]*id="ns_g".*?</memberdef>',
+            '',
+            doxygen_xml.namespace.format(f='F', g='G'),
+            flags=re.S))
+
+    files = run()
+    assert 'ns__g.qbk' in files
+    with open(os.path.join(pages, 'notes.qbk'), 'w') as file:
+        file.write('not a page')
+
+    # files of pages that no longer exist are removed in every mode, and
+    # other files are kept
+    remove_g()
+    assert run() == sorted(set(files) - {'ns__g.qbk'} | {'notes.qbk'})
+
+    doxygen_xml.write_namespace()
+    assert run('--incremental') == sorted(files + ['notes.qbk'])
+    remove_g()
+    assert run() == sorted(set(files) - {'ns__g.qbk'} | {'notes.qbk'})
+
+def test_session(tmpdir, doxygen_xml):
+    doxygen_xml.write('config.json', '{"link_prefix": "lib."}')
+
+    session = docca.Session()
+    reads = []
+    read_compound = session.read_compound
+    def read(file_name):
+        reads.append(os.path.basename(file_name))
+        return read_compound(file_name)
+    session.read_compound = read
+
+    def run(*args):
+        stdout = io.StringIO()
+        session.main(
+            ['docca', '-i', os.path.join(tmpdir, 'index.xml')] + list(args),
+            None,
+            stdout,
+            docca.__file__)
+        return stdout.getvalue()
+
+    result = run()
+    assert '[link ns__f' in result
+    assert sorted(reads) == ['ns.xml', 'ns_c.xml']
+    env = next(iter(session._environments.values()))
+    data = next(iter(session._models.values()))[1]
+
+    reads.clear()
+    assert run() == result
+    assert reads == []
+    assert next(iter(session._models.values()))[1] is data
+
+    assert '[link lib.ns__f' in run('-c', os.path.join(tmpdir, 'config.json'))
+    assert 'link_prefix' not in env.globals['Config']
+    assert run() == result
+    assert len(session._environments) == 2
+
+    # changes that extensions make to the configuration are kept
+    doxygen_xml.write('ext.py', '''\
+def install_docca_extension(env):
+    env.globals['Config']['link_prefix'] = 'ext.'
+''')
+    ext = os.path.join(tmpdir, 'ext.py')
+    extended = run('-E', ext)
+    assert '[link ext.ns__f' in extended
+    assert run('-E', ext) == extended
+    assert run() == result
+
+    doxygen_xml.write_namespace('F2', 'G')
+    reads.clear()
+    result = run()
+    assert 'F2' in result
+    assert reads == ['ns.xml', 'ns_c.xml']
+    assert next(iter(session._models.values()))[1] is not data
+
+@pytest.mark.skipif(
+    not hasattr(socket, 'AF_UNIX'), reason='requires Unix sockets')
+def test_daemon(tmpdir, doxygen_xml):
+    expected = io.StringIO()
+    argv = ['docca', '-i', os.path.join(tmpdir, 'index.xml')]
+    docca.main(argv, None, expected, docca.__file__)
+
+    path = os.path.join(tmpdir, 'docca.sock')
+    with docca.Daemon(path, docca.__file__) as daemon:
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            with pytest.raises(RuntimeError):
+                docca.Daemon(path, docca.__file__)
+
+            argv += ['--connect', path]
+            for _ in range(2):
+                stdout = io.StringIO()
+                stderr = io.StringIO()
+                status = docca.connect(path, argv, None, stdout, stderr)
+                assert status == 0
+                assert stdout.getvalue() == expected.getvalue()
+
+            with open(os.path.join(tmpdir, 'index.xml')) as stdin:
+                stdout = io.StringIO()
+                status = docca.connect(
+                    path,
+                    ['docca', '-D', str(tmpdir), '--connect', path],
+                    stdin,
+                    stdout,
+                    stderr)
+            assert status == 0
+            assert stdout.getvalue() == expected.getvalue()
+
+            status = docca.connect(
+                path,
+                ['docca', '-i', os.path.join(tmpdir, 'missing.xml')],
+                None,
+                stdout,
+                stderr)
+            assert status == 1
+            assert 'FileNotFoundError' in stderr.getvalue()
+        finally:
+            daemon.shutdown()
+            thread.join()
+    assert not os.path.exists(path)
+
+def test_batch(tmpdir, doxygen_xml):
+    doxygen_xml.write('config.json', '{"link_prefix": "lib."}')
+    doxygen_xml.write('jobs.json', json.dumps([
+        dict(input='index.xml', output='1.qbk'),
+        dict(input='index.xml', config=['config.json'], output='2.qbk'),
+        dict(input='missing.xml', output='3.qbk'),
+        dict(
+            input='index.xml',
+            output='4.qbk',
+            output_dir='pages',
+            incremental=True,
+            render_jobs=2),
+    ]))
+
+    def expected(*args):
+        stdout = io.StringIO()
+        docca.main(
+            ['docca', '-i', os.path.join(tmpdir, 'index.xml')] + list(args),
+            None,
+            stdout,
+            docca.__file__)
+        return stdout.getvalue()
+
+    def read(name):
+        with open(os.path.join(tmpdir, name), encoding='utf-8') as file:
+            return file.read()
+
+    for workers in (1, 2):
+        stderr = io.StringIO()
+        status = docca.run_batch(
+            os.path.join(tmpdir, 'jobs.json'),
+            workers,
+            docca.__file__,
+            stderr)
+        assert status == 1
+        assert read('1.qbk') == expected()
+        assert read('2.qbk') == expected(
+            '-c', os.path.join(tmpdir, 'config.json'))
+        assert not os.path.exists(os.path.join(tmpdir, '3.qbk'))
+        assert '[include pages/ns__c.qbk]' in read('4.qbk')
+
+        lines = stderr.getvalue().splitlines()
+        assert 'docca: job for %s failed' % os.path.join(
+            tmpdir, '3.qbk') in lines
+        assert lines[-1].startswith('docca: 4 jobs, 1 failed')
+
+    # jobs that cannot be set up do not stop others
+    doxygen_xml.write('invalid.json', '{')
+    doxygen_xml.write('bad.json', json.dumps([
+        dict(input='index.xml', config=['missing.json'], output='5.qbk'),
+        dict(input='index.xml', config=['invalid.json'], output='6.qbk'),
+        dict(input='index.xml', template='missing.jinja2', output='7.qbk'),
+        dict(input='index.xml', output='8.qbk'),
+    ]))
+    stderr = io.StringIO()
+    status = docca.run_batch(
+        os.path.join(tmpdir, 'bad.json'), 2, docca.__file__, stderr)
+    assert status == 1
+    assert read('8.qbk') == expected()
+    lines = stderr.getvalue().splitlines()
+    for name in ('5.qbk', '6.qbk', '7.qbk'):
+        assert 'docca: job for %s failed' % os.path.join(
+            tmpdir, name) in lines
+    assert 'missing.json' in stderr.getvalue()
+    assert 'missing.jinja2' in stderr.getvalue()
+    assert lines[-1].startswith('docca: 4 jobs, 3 failed')
+
+    # jobs see changes that extensions make to the configuration
+    doxygen_xml.write('ext.py', '''\
+def install_docca_extension(env):
+    env.globals['Config']['link_prefix'] = 'ext.'
+''')
+    doxygen_xml.write('ext.json', json.dumps([
+        dict(input='index.xml', extension=['ext.py'], output='9.qbk'),
+        dict(input='index.xml', extension=['ext.py'], output='10.qbk'),
+    ]))
+    for workers in (1, 2):
+        status = docca.run_batch(
+            os.path.join(tmpdir, 'ext.json'),
+            workers,
+            docca.__file__,
+            io.StringIO())
+        assert status == 0
+        extended = expected('-E', os.path.join(tmpdir, 'ext.py'))
+        assert '[link ext.ns__f' in extended
+        assert read('9.qbk') == extended
+        assert read('10.qbk') == extended
+
+    with pytest.raises(RuntimeError):
+        docca.batch_arguments(dict(input='index.xml'), '')
+
+    # only one mode of operation at a time
+    modes = (
+        ['--watch', '-i', 'index.xml', '-o', 'out.qbk'],
+        ['--batch', 'jobs.json'],
+        ['--daemon', 'docca.sock'],
+        ['--connect', 'docca.sock'],
+    )
+    for i, first in enumerate(modes):
+        for second in modes[i + 1:]:
+            with pytest.raises(SystemExit):
+                docca.parse_args(['docca'] + first + second)
+
+def test_watch(tmpdir, doxygen_xml, monkeypatch):
+    output = os.path.join(tmpdir, 'out.qbk')
+    def read():
+        with open(output, encoding='utf-8') as file:
+            return file.read()
+
+    # changes that extensions make to the configuration are kept when the
+    # environment is reused
+    doxygen_xml.write('ext.py', '''\
+def install_docca_extension(env):
+    env.globals['Config']['link_prefix'] = 'ext.'
+''')
+    stderr = io.StringIO()
+    thread = threading.Thread(
+        target=docca.watch,
+        args=(
+            [
+                'docca', '--watch',
+                '-i', os.path.join(tmpdir, 'index.xml'), '-o', output,
+                '-E', os.path.join(tmpdir, 'ext.py'),
+            ],
+            docca.__file__,
+            stderr,
+            0.01,
+            2))
+    thread.start()
+    try:
+        for _ in range(500):
+            if os.path.exists(output):
+                break
+            thread.join(0.01)
+        assert 'G' in read()
+        assert '[link ext.ns__f' in read()
+        doxygen_xml.write_namespace('F', 'Changed')
+    finally:
+        thread.join(10)
+    assert not thread.is_alive()
+    assert 'Changed' in read()
+    assert '[link ext.ns__f' in read()
+    assert 'ns.xml changed' in stderr.getvalue()
+
+    # paths relative to the current directory, and missing files
+    monkeypatch.chdir(tmpdir)
+    os.remove(output)
+    stderr = io.StringIO()
+    docca.watch(
+        ['docca', '--watch', '-i', 'index.xml', '-o', 'out.qbk'],
+        docca.__file__,
+        stderr,
+        0.01,
+        1)
+    assert 'Changed' in read()
+    assert 'docca: rendered' in stderr.getvalue()
+
+    stderr = io.StringIO()
+    docca.watch(
+        [
+            'docca', '--watch', '-i', 'index.xml', '-o', 'out.qbk',
+            '-c', 'missing.json',
+        ],
+        docca.__file__,
+        stderr,
+        0.01,
+        1)
+    assert 'missing.json' in stderr.getvalue()
+    assert 'docca: failed' in stderr.getvalue()
+
+    stderr = io.StringIO()
+    docca.watch(
+        ['docca', '--watch', '-i', 'index.xml', '-o', 'out.qbk', '-D', 'no'],
+        docca.__file__,
+        stderr,
+        0.01,
+        1)
+    assert 'docca: failed' in stderr.getvalue()
+
+    with pytest.raises(SystemExit):
+        docca.parse_args(['docca', '--watch', '-i', 'index.xml'])
+
+def test_deferred_imports(tmpdir):
+    def imported(code):
+        result = subprocess.run(
+            [
+                sys.executable, '-c',
+                'import sys\n' + code + '\nprint(" ".join(sys.modules))',
+            ],
+            cwd=os.path.dirname(docca.__file__),
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True)
+        return result.stdout.split()
+
+    modules = imported('import docca')
+    for module in ('argparse', 'jinja2', 'json', 'multiprocessing', 'socket',
+            'xml.etree.ElementTree'):
+        assert module not in modules
+
+    # classes derived from classes of those modules are real classes
+    assert issubclass(docca.Environment, jinja2.Environment)
+    assert issubclass(docca.BytecodeCache, jinja2.BytecodeCache)
+    assert issubclass(docca.AcceptOneorNone, argparse.Action)
+    with pytest.raises(AttributeError):
+        docca.NoSuchClass
+
+    modules = imported('''
+import docca
+docca.collect_data('.', [])''')
+    assert 'xml.etree.ElementTree' not in modules
+    assert 'jinja2' not in modules
+
+    path = os.path.join(tmpdir, '0.xml')
+    with open(path, 'w') as file:
+        file.write(_compound.format(0, 'class', 'compoundname'))
+    modules = imported('import docca\ndocca.read_compound(%r)' % path)
+    assert 'xml.etree.ElementTree' in modules
+    assert 'jinja2' not in modules
+
+def test_cli_extension(tmpdir, doxygen_xml):
+    # in a fresh process nothing has imported the modules that loading
+    # extensions needs before extensions are loaded
+    doxygen_xml.write('ext.py', (
+        'def install_docca_extension(env):\n'
+        '    env.globals["Config"]["link_prefix"] = "ext."\n'))
+
+    output = os.path.join(tmpdir, 'out.qbk')
+    subprocess.run(
+        [
+            sys.executable, docca.__file__,
+            '-i', os.path.join(tmpdir, 'index.xml'),
+            '-E', os.path.join(tmpdir, 'ext.py'),
+            '-o', output,
+        ],
+        stderr=subprocess.PIPE,
+        check=True)
+    with open(output, encoding='utf-8') as file:
+        assert '[link ext.ns__f' in file.read()
+
+def test_library_api(tmpdir, doxygen_xml):
+    index = os.path.join(tmpdir, 'index.xml')
+
+    expected = io.StringIO()
+    docca.main(['docca', '-i', index], None, expected, docca.__file__)
+
+    model = docca.build_model(index)
+    assert isinstance(model, docca.Index)
+    assert docca.render_model(model) == expected.getvalue()
+    with open(index, 'r', encoding='utf-8') as file:
+        other = docca.build_model(file, str(tmpdir))
+    assert set(other) == set(model)
+    assert other['ns_c'] is not model['ns_c']
+
+    output = io.StringIO()
+    docca.render_model(model, output, dict(link_prefix='lib.'))
+    assert '[link lib.ns__f' in output.getvalue()
+
+    doxygen_xml.write('ext.py', '''\
+import sys
+assert sys.modules[__name__]
+def install_docca_extension(env):
+    env.globals['Config']['link_prefix'] = 'ext.'
+''')
+    modules = set(sys.modules)
+    result = docca.render_model(
+        model, extensions=[os.path.join(tmpdir, 'ext.py')])
+    assert '[link ext.ns__f' in result
+    assert set(sys.modules) == modules
+
+    # entities created without an index do not share one
+    a = docca.Namespace(
+        make_elem({'tag': 'compound', 'id': 'a', 'items': [
+            { 'tag': 'compoundname', 'items': ['a'] }]}))
+    b = docca.Namespace(
+        make_elem({'tag': 'compound', 'id': 'b', 'items': [
+            { 'tag': 'compoundname', 'items': ['b'] }]}))
+    assert a.index is not b.index
+    assert list(a.index) == ['a']
+
+    # a session keeps the environment, so that the default templates are not
+    # compiled again for every build, which is slow with tracemalloc
+    session = docca.Session()
+    def build():
+        result = docca.render_model(docca.build_model(index), session=session)
+        assert result == expected.getvalue()
+
+    # allocations are traced from the start, so that entries replaced in
+    # interpreter and Jinja caches do not look like growth
+    tracemalloc.start()
+    try:
+        for _ in range(20):
+            build()
+        gc.collect()
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(100):
+            build()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # a leaked model would take about 9 KiB, so 100 of them about 900 KiB
+    assert after - before < 256 * 1024
+    assert len(session._environments) == 1
+
+def test_timings(tmpdir, doxygen_xml):
+    timings = docca.Timings()
+    with timings.phase('outer'):
+        with timings.phase('inner'):
+            time.sleep(0.02)
+    with timings.phase('inner'):
+        pass
+    timings.count('things', 2)
+    timings.count('things', 3)
+    assert list(timings.phases) == ['outer', 'inner']
+    assert timings.phases['inner'][0] >= 0.02
+    assert timings.phases['outer'][0] < 0.02
+    assert timings.counts == dict(things=5)
+
+    text = io.StringIO()
+    timings.report(text)
+    assert re.search(r'^  inner +[0-9.]+ +[0-9.]+$', text.getvalue(), re.M)
+    assert re.search(r'^  things +5$', text.getvalue(), re.M)
+
+    output = os.path.join(tmpdir, 'out.qbk')
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        docca.Session().main(
+            [
+                'docca', '--timings=json', '-j', '2',
+                '-i', os.path.join(tmpdir, 'index.xml'), '-o', output,
+            ],
+            None,
+            None,
+            docca.__file__)
+    result = json.loads(stderr.getvalue().splitlines()[-1])
+    assert [p['name'] for p in result['phases']] == [
+        'config', 'extensions', 'environment', 'index scan', 'parse',
+        'update scopes', 'resolve references', 'write', 'render',
+        'template compile']
+    assert all(p['wall'] >= 0 for p in result['phases'])
+    assert result['total']['wall'] == pytest.approx(
+        sum(p['wall'] for p in result['phases']))
+    assert result['counts']['compounds'] == 2
+    assert result['counts']['entities'] == len(
+        docca.build_model(os.path.join(tmpdir, 'index.xml')))
+    assert result['counts']['pages'] == 3
+    assert result['counts']['pages rendered'] == 3
+    assert result['counts']['output bytes'] == os.path.getsize(output)
+    assert result['counts']['XML bytes'] == sum(
+        os.path.getsize(os.path.join(tmpdir, name))
+        for name in ('ns.xml', 'ns_c.xml'))
+
+    with pytest.raises(SystemExit):
+        docca.parse_args(['docca', '--timings=csv'])
+    assert docca.parse_args(['docca', '--timings']).timings == 'text'
+    assert docca.parse_args(['docca']).timings is None
+
+def test_render_profile(tmpdir, doxygen_xml):
+    env = jinja2.Environment(loader=jinja2.DictLoader({
+        'main.jinja2': (
+            '{% macro inner(x) %}<{{ x }}>{% endmacro %}'
+            '{% macro write_entity(e) %}'
+            '{{ inner(e.fully_qualified_name) }}'
+            '{% for m in e.members %}{{ write_entity(m) }}{% endfor %}'
+            '{% endmacro %}'
+            '{{ write_entity(root) }}'),
+    }))
+    entity = lambda name, *members: types.SimpleNamespace(
+        fully_qualified_name=name, members=members)
+    root = entity('a', entity('a::b', entity('a::b::c')), entity('a::d'))
+
+    invoke = jinja2.runtime.Macro._invoke
+    template = env.get_template('main.jinja2')
+    with docca.RenderProfile() as profile:
+        start = time.perf_counter()
+        result = template.render(root=root)
+        elapsed = time.perf_counter() - start
+    assert jinja2.runtime.Macro._invoke is invoke
+    assert result == '<a><a::b><a::b::c><a::d>'
+
+    assert profile.macros['write_entity'][0] == 4
+    assert profile.macros['inner'][0] == 4
+    for calls, inclusive, exclusive in profile.macros.values():
+        assert exclusive <= inclusive
+    # recursive calls are not counted twice
+    assert profile.macros['write_entity'][1] <= elapsed
+    assert sorted(profile.entities) == ['a', 'a::b', 'a::b::c', 'a::d']
+    assert [profile.entities[name][1] for name in sorted(profile.entities)] \
+        == [3, 6, 9, 6]
+
+    text = io.StringIO()
+    profile.report(text, 2)
+    assert re.search(r'^  write_entity +4 ', text.getvalue(), re.M)
+    assert len(text.getvalue().splitlines()) == 3 + 1 + 2
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        docca.Session().main(
+            [
+                'docca', '--profile-render', '1', '-j', '2',
+                '-i', os.path.join(tmpdir, 'index.xml'),
+            ],
+            None,
+            stdout,
+            docca.__file__)
+    assert jinja2.runtime.Macro._invoke is invoke
+    report = stderr.getvalue()
+    assert re.search(r'^  write_type +[0-9]+ ', report, re.M)
+    assert re.search(r'^  ns::[a-z]+ +[0-9.]+ +[0-9]+$', report, re.M)
+    assert stdout.getvalue() == docca.render_model(
+        docca.build_model(os.path.join(tmpdir, 'index.xml')))
+
+    assert docca.parse_args(['docca', '--profile-render']).profile_render \
+        == 20
+    assert docca.parse_args(['docca']).profile_render is None
+
+def test_trace(tmpdir, doxygen_xml):
+    doxygen_xml.write('ext.py', 'def install_docca_extension(env):\n    pass\n')
+    doxygen_xml.write('jobs.json', json.dumps([
+        dict(input='index.xml', output='1.qbk'),
+        dict(input='index.xml', output='2.qbk'),
+    ]))
+
+    def load(name):
+        with open(os.path.join(tmpdir, name), encoding='utf-8') as file:
+            events = json.load(file)['traceEvents']
+        for event in events:
+            assert event['pid'] == os.getpid()
+        lanes = dict(
+            (event['tid'], event['args']['name'])
+            for event in events if event['name'] == 'thread_name')
+        assert lanes[os.getpid()] == 'main'
+        events = [event for event in events if event['ph'] == 'X']
+        for event in events:
+            assert event['ts'] >= 0 and event['dur'] >= 0
+            assert event['tid'] in lanes
+        return events, lanes
+
+    stdout = io.StringIO()
+    session = docca.Session()
+    session.main(
+        [
+            'docca', '--trace', os.path.join(tmpdir, 'trace.json'),
+            '-E', os.path.join(tmpdir, 'ext.py'), '-j', '2',
+            '-i', os.path.join(tmpdir, 'index.xml'),
+        ],
+        None,
+        stdout,
+        docca.__file__)
+    assert session.trace is None
+    events, lanes = load('trace.json')
+    names = lambda category: sorted(
+        event['name'] for event in events if event['cat'] == category)
+    assert names('read') == ['ns.xml', 'ns_c.xml']
+    assert names('parse') == ['ns.xml', 'ns_c.xml']
+    assert names('construct') == ['ns', 'ns_c']
+    assert names('resolve') == sorted(
+        docca.build_model(os.path.join(tmpdir, 'index.xml')))
+    assert names('extension') == ['install ext.py', 'load ext.py']
+    assert names('page') == ['ns::c', 'ns::f', 'ns::g']
+    assert 'render' in names('phase')
+    if hasattr(os, 'fork'):
+        workers = set(
+            event['tid'] for event in events if event['cat'] == 'page')
+        assert os.getpid() not in workers
+        assert all(lanes[tid].startswith('worker ') for tid in workers)
+    assert stdout.getvalue() == docca.render_model(
+        docca.build_model(os.path.join(tmpdir, 'index.xml')))
+
+    stderr = io.StringIO()
+    assert docca.run_batch(
+        os.path.join(tmpdir, 'jobs.json'),
+        2,
+        docca.__file__,
+        stderr,
+        os.path.join(tmpdir, 'batch.json')) == 0
+    events, lanes = load('batch.json')
+    jobs = [event for event in events if event['cat'] == 'job']
+    assert sorted(event['name'] for event in jobs) == [
+        os.path.join(tmpdir, '1.qbk'), os.path.join(tmpdir, '2.qbk')]
+    assert len([event for event in events if event['cat'] == 'read']) == 4
+
 def test_open_output(tmpdir):
     stdout = io.StringIO()
 
@@ -2267,12 +3232,43 @@ def test_open_output(tmpdir):
 
     args.output = os.path.join(tmpdir, 'output')
     file, ctx = docca.open_output(stdout, args)
-    assert ctx == file
+    assert isinstance(ctx, docca.AtomicFile)
     with ctx:
         file.write('пример')
+    assert ctx.changed
 
     with open(args.output, 'r', encoding='utf-8') as file:
         assert file.read() == 'пример'
+    assert os.listdir(tmpdir) == ['output']
+
+def test_atomic_file(tmpdir):
+    path = os.path.join(tmpdir, 'output')
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('old')
+    os.chmod(path, 0o640)
+    os.utime(path, (1000, 1000))
+
+    ctx = docca.AtomicFile(path)
+    with ctx as file:
+        file.write('old')
+    assert not ctx.changed
+    assert os.stat(path).st_mtime == 1000
+
+    with pytest.raises(RuntimeError):
+        with docca.AtomicFile(path) as file:
+            file.write('partial')
+            raise RuntimeError()
+    with open(path, 'r', encoding='utf-8') as file:
+        assert file.read() == 'old'
+
+    ctx = docca.AtomicFile(path)
+    with ctx as file:
+        file.write('new')
+    assert ctx.changed
+    with open(path, 'r', encoding='utf-8') as file:
+        assert file.read() == 'new'
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert os.listdir(tmpdir) == ['output']
 
 def test_load_configs(tmpdir):
     args = argparse.Namespace()
@@ -2354,6 +3350,57 @@ def test_load_configs(tmpdir):
         'allowed_prefixes': ['a::', 'b::c::'],
     }
 
+    d = os.path.join(tmpdir, 'c6')
+    with open(d, 'w', encoding='utf-8') as f:
+        f.write('{ "replace_strings": { "a": "b", "(c": "d" } }')
+    args.config.append(d)
+    with pytest.raises(RuntimeError, match=r"'\(c' in replace_strings of"):
+        docca.load_configs(args)
+
+def test_string_replacer():
+    def reference(table, s):
+        for src, tgt in table.items():
+            s = re.sub(src, tgt, s, flags=re.U)
+        return s
+
+    tables = [
+        dict(),
+        {'foobar': 'FooBar'},
+        {'foob\\b': 'FooBar'},
+        {'\\bf(o+)bar\\b': 'F\\1BaR'},
+        {'a': 'b', 'b': 'c'},
+        {'(x)\\1': 'y', 'z': 'x'},
+        {'(?i)q': 'w'},
+    ]
+    strings = ['', 'foobar fobar', 'foob', 'ab', 'xxzz', 'aQq', 'nothing']
+    for table in tables:
+        replacer = docca.StringReplacer(table)
+        for s in strings:
+            assert replacer(s) == reference(table, s)
+
+    assert docca.StringReplacer({'a': 'b'})._prefilter
+    assert not docca.StringReplacer({'(x)\\1': 'y'})._prefilter
+
+    # each environment has its own replacer, which follows its configuration
+    loader = jinja2.DictLoader({'t': '{{ entities | replace_strings }}'})
+    config = dict(replace_strings={'a': 'b'})
+    env = docca.construct_environment(loader, config)
+    other = docca.construct_environment(loader, dict())
+
+    def render(env):
+        output = io.StringIO()
+        docca.render(env, 't', output, 'ac')
+        return output.getvalue()
+    assert render(env) == 'bc'
+    replacer = env.markup.replacer
+    assert render(other) == 'ac'
+    assert render(env) == 'bc'
+    assert env.markup.replacer is replacer
+
+    config['replace_strings'] = {'a': 'b', 'c': 'd'}
+    assert render(env) == 'bd'
+    assert render(other) == 'ac'
+
 def test_docca_include_dir():
     script = os.path.join('no/such/path/foo')
     assert docca.docca_include_dir(script) == 'no/such/path/include'
@@ -2407,6 +3454,226 @@ def test_construct_environment():
     assert env.globals['ParameterList'] == docca.ParameterList
     assert env.globals['Config'] == conf
     assert env.globals['re'] == re
+    assert env.bytecode_cache is None
+
+    cache = jinja2.BytecodeCache()
+    env = docca.construct_environment(loader, conf, cache)
+    assert env.bytecode_cache is cache
+
+def test_bytecode_cache(tmpdir):
+    args = argparse.Namespace()
+    args.cache_dir = None
+    assert docca.cache_directory(args, dict()) is None
+    assert docca.cache_directory(args, dict(DOCCA_CACHE_DIR='a')) == 'a'
+    args.cache_dir = 'b'
+    assert docca.cache_directory(args, dict(DOCCA_CACHE_DIR='a')) == 'b'
+
+    cache_dir = os.path.join(tmpdir, 'cache')
+    loader = jinja2.DictLoader({'tmpl': _simple_template})
+
+    def compile():
+        env = docca.construct_environment(
+            loader, dict(), docca.BytecodeCache(cache_dir))
+        file = io.StringIO()
+        docca.render(env, 'tmpl', file, [1, 2])
+        assert file.getvalue() == '1, 2'
+        return env.compiled_templates
+
+    assert compile() == 1
+    assert os.listdir(cache_dir)
+    assert compile() == 0
+
+    ext = os.path.join(tmpdir, 'ext.py')
+    with open(ext, 'w') as f:
+        f.write('# extension')
+    cache = docca.BytecodeCache(cache_dir, [ext])
+    assert cache.salt != docca.BytecodeCache(cache_dir).salt
+    assert cache.get_cache_key('tmpl') != docca.BytecodeCache(
+        cache_dir).get_cache_key('tmpl')
+
+def test_visibility():
+    prefixes = docca.PrefixSet(['a::b::', 'c'])
+    assert prefixes.related('a')
+    assert prefixes.related('a::b')
+    assert prefixes.related('a::b::d')
+    assert prefixes.related('cd::e')
+    assert not prefixes.related('a::c')
+    assert not prefixes.related('b')
+    assert docca.PrefixSet(['']).related('a::b')
+    assert not docca.PrefixSet([]).related('')
+
+    index = dict()
+    inner = docca.Namespace(
+        make_elem({
+            'tag': 'compound',
+            'id': 'ns1',
+            'items': [
+                { 'tag': 'compoundname', 'items': ['outer::inner'] },
+                { 'tag': 'briefdescription', 'items': [' !!! '] },
+            ]
+        }),
+        index)
+    outer = docca.Namespace(
+        make_elem({
+            'tag': 'compound',
+            'id': 'ns2',
+            'items': [
+                { 'tag': 'compoundname', 'items': ['outer'] },
+                { 'tag': 'innernamespace', 'refid': 'ns1' },
+            ]
+        }),
+        index)
+    for entity in index.values():
+        entity.resolve_references()
+
+    assert inner.brief_text == '!!!'
+    assert outer.brief_text == ''
+    assert inner.external_url == ''
+
+    conf = dict(allowed_prefixes=['outer::'])
+    visibility = docca.Visibility(conf)
+    assert visibility.is_visible(outer)
+    assert visibility.is_visible(inner)
+    assert not visibility.is_external(inner)
+
+    conf = dict(allowed_prefixes=['other::'], external_marker='!!!')
+    visibility = docca.Visibility(conf)
+    assert not visibility.is_visible(outer)
+    assert not visibility.is_visible(inner)
+    assert visibility.is_external(inner)
+
+def test_links():
+    assert docca.sanitize_path_segment('operator<=>') == 'operator_spshp_'
+    assert docca.sanitize_path_segment('operator[]') == 'operator__lb__rb_'
+    assert docca.sanitize_path_segment('a::b') == 'a__b'
+
+    index = dict()
+    ns = docca.Namespace(
+        make_elem({
+            'tag': 'compound',
+            'id': 'ns1',
+            'items': [
+                { 'tag': 'compoundname', 'items': ['my::ns'] },
+                {
+                    'tag': 'sectiondef',
+                    'items': [
+                        {
+                            'tag': 'memberdef',
+                            'id': 'v1',
+                            'kind': 'variable',
+                            'items': [
+                                { 'tag': 'name', 'items': ['v'] },
+                                { 'tag': 'type', 'items': ['int'] },
+                            ],
+                        },
+                    ],
+                },
+            ]
+        }),
+        index)
+    for entity in index.values():
+        entity.resolve_references()
+    v = index['v1']
+
+    assert docca.entity_anchor(ns) == 'ns'
+    assert docca.entity_anchor(v) == 'ns__v'
+    assert docca.entity_anchor(v) is docca.entity_anchor(v)
+    assert docca.entity_link(ns) == 'ns'
+    assert docca.entity_link(v, link_prefix='a.b.') == 'a.b.ns__v'
+    assert docca.entity_link(v) == 'ns__v'
+
+def test_fragment_cache():
+    calls = []
+    def macro(obj, nesting=''):
+        calls.append(obj)
+        return nesting + str(len(obj))
+
+    cache = docca.FragmentCache()
+    a = [1, 2]
+    b = [1, 2]
+    assert cache(macro, a) == '2'
+    assert cache(macro, a) == '2'
+    assert cache(macro, b) == '2'
+    assert cache(macro, a, nesting='  ') == '  2'
+    assert calls == [a, b, a]
+    assert cache.hits == 1
+    assert cache.misses == 3
+
+    loader = jinja2.DictLoader({
+        'tmpl': '''\
+{%- macro m(x) %}{% do entities.append(x) %}[{{ x }}]{% endmacro -%}
+{{ render_once(m, 'a') }}{{ render_once(m, 'a') }}''',
+    })
+    env = docca.construct_environment(loader, dict())
+    for _ in range(2):
+        data = []
+        file = io.StringIO()
+        docca.render(env, 'tmpl', file, data)
+        assert file.getvalue() == '[a][a]'
+        assert data == ['a']
+
+def test_render_jobs():
+    loader = jinja2.DictLoader({
+        'tmpl': '''\
+{%- macro m(x) %}<{{ x }}{% for y in range(x) %}{{ page(m, y) }}{% endfor %}>\
+{% endmacro -%}
+{% for x in entities %}{{ page(m, x) }}{% endfor %}''',
+    })
+    env = docca.construct_environment(loader, dict())
+
+    file = io.StringIO()
+    docca.render(env, 'tmpl', file, [3, 0, 2])
+    expected = file.getvalue()
+    assert expected == '<3<0><1<0>><2<0><1<0>>>><0><2<0><1<0>>>'
+
+    for jobs in (2, 4):
+        file = io.StringIO()
+        docca.render(env, 'tmpl', file, [3, 0, 2], jobs)
+        assert file.getvalue() == expected
+        assert env.pages.deferred is None
+
+    file = io.StringIO()
+    docca.render(env, 'tmpl', file, [], 2)
+    assert file.getvalue() == ''
+
+def test_compile_templates(tmpdir):
+    templates = {
+        'main.tmpl': '{% include "part.jinja2" %}',
+        'part.jinja2': _simple_template,
+        'other.txt': '{{',
+    }
+    env = docca.construct_environment(jinja2.DictLoader(templates), dict())
+
+    for target in ('bundle', 'bundle.zip'):
+        target = os.path.join(tmpdir, target)
+        docca.compile_templates(env, 'path/to/main.tmpl', target)
+        if target.endswith('.zip'):
+            with zipfile.ZipFile(target) as archive:
+                files = archive.namelist()
+        else:
+            files = os.listdir(target)
+        # modules are stored compiled, and only for the template set
+        assert len(files) == 2
+        assert all(file.endswith('.pyc') for file in files)
+
+        args = argparse.Namespace()
+        args.bundle = target
+        loader = docca.template_loader('main.tmpl', 'include', args)
+        assert isinstance(loader, jinja2.ModuleLoader)
+
+        file = io.StringIO()
+        docca.render(
+            docca.construct_environment(loader, dict()),
+            'path/to/main.tmpl',
+            file,
+            [1, 2, 3])
+        assert file.getvalue() == '1, 2, 3'
+
+    args.bundle = None
+    args.include = []
+    loader = docca.template_loader('a/main.tmpl', 'include', args)
+    assert isinstance(loader, jinja2.FileSystemLoader)
+    assert loader.searchpath == ['a', 'include']
 
 def test_load_extensions():
     exts = docca.load_extensions([])
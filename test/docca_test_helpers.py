@@ -7,6 +7,9 @@
 # Official repository: https://github.com/boostorg/json
 #
 
+import os
+import pytest
+
 class MockXmlElem():
     def __init__(self, tag='compound'):
         self.tag = tag
@@ -74,3 +77,69 @@ def make_elem(contents):
     result.update(**attrs)
 
     return result
+
+class DoxygenXml():
+    # a small Doxygen XML output in directory: namespace ns with functions f
+    # and g, whose briefs are set by write_namespace, and class ns::c, whose
+    # brief refers to f
+    index = '''\
+<?xml version='1.0'?>
+<doxygenindex>
+  <compound refid="ns" kind="namespace"/>
+  <compound refid="ns_c" kind="class"/>
+</doxygenindex>
+'''
+    namespace = '''\
+<?xml version='1.0'?>
+<doxygen>
+  <compounddef id="ns" kind="namespace">
+    <compoundname>ns</compoundname>
+    <innerclass refid="ns_c" prot="public">ns::c</innerclass>
+    <sectiondef kind="func">
+      <memberdef kind="function" id="ns_f" prot="public">
+        <type>void</type><name>f</name><argsstring>()</argsstring>
+        <briefdescription><para>{f}</para></briefdescription>
+      </memberdef>
+      <memberdef kind="function" id="ns_g" prot="public">
+        <type>void</type><name>g</name><argsstring>()</argsstring>
+        <briefdescription><para>{g}</para></briefdescription>
+      </memberdef>
+    </sectiondef>
+  </compounddef>
+</doxygen>
+'''
+    klass = '''\
+<?xml version='1.0'?>
+<doxygen>
+  <compounddef id="ns_c" kind="class" prot="public">
+    <compoundname>ns::c</compoundname>
+    <briefdescription>
+      <para>See <ref refid="ns_f" kindref="member">f</ref>.</para>
+    </briefdescription>
+  </compounddef>
+</doxygen>
+'''
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.write('index.xml', self.index)
+        self.write('ns_c.xml', self.klass)
+        self.write_namespace()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, content):
+        path = self.path(name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        # make sure the change is visible with coarse timestamps
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def write_namespace(self, f='F', g='G'):
+        self.write('ns.xml', self.namespace.format(f=f, g=g))
+
+@pytest.fixture
+def doxygen_xml(tmpdir):
+    return DoxygenXml(tmpdir)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2024 Dmitry Arkhipov (grisumbras@yandex.ru)
+#
+# Distributed under the Boost Software License, Version 1.0. (See accompanying
+# file LICENSE_1_0.txt or copy at http://www.boost.org/LICENSE_1_0.txt)
+#
+# Official repository: https://github.com/boostorg/docca
+#
+
+import argparse
+import io
+import jinja2
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_root = os.path.join(_here, '..', '..')
+sys.path.insert(0, _root)
+sys.path.insert(0, _here)
+
+import docca
+import synthetic
+
+
+def report(name, value, unit=''):
+    if isinstance(value, float):
+        value = '%.3f' % value
+    print('  %-32s %12s %s' % (name, value, unit))
+
+def timed(func, *args, **kw):
+    start = time.perf_counter()
+    result = func(*args, **kw)
+    return result, time.perf_counter() - start
+
+def build_model(index_path):
+    result = dict()
+    with open(index_path, 'r', encoding='utf-8') as file:
+        refs, result['index scan'] = timed(
+            lambda: list(docca.collect_compound_refs(file)))
+    data_dir = os.path.dirname(index_path)
+    entities, result['compound load'] = timed(
+        docca.load_compounds, data_dir, refs)
+    _, result['update scopes'] = timed(docca.update_scopes, entities)
+    _, result['resolve references'] = timed(
+        docca.resolve_references, entities)
+    return entities, result
+
+def count_nodes(entities):
+    references = 0
+    distinct = set()
+    parts = 0
+
+    def visit(node):
+        nonlocal references, parts
+        if node is None or isinstance(node, str):
+            return
+        references += 1
+        if isinstance(node, docca.PhraseContainer):
+            parts += len(node)
+        if id(node) in distinct:
+            return
+        distinct.add(id(node))
+
+        children = []
+        for attr in ('_parts', '_items', '_blocks', '_rows', '_params'):
+            children.extend(getattr(node, attr, ()))
+        for attr in ('title', 'caption', 'type', 'name'):
+            child = getattr(node, attr, None)
+            if child is not None and not isinstance(child, str):
+                children.append(child)
+        description = getattr(node, 'description', None)
+        if isinstance(description, (list, tuple)):
+            children.extend(description)
+        for child in children:
+            if isinstance(child, (list, tuple)):
+                for grandchild in child:
+                    visit(grandchild)
+            else:
+                visit(child)
+
+    for entity in entities.values():
+        for blocks in (entity.brief, entity.description):
+            for block in blocks:
+                visit(block)
+        for attr in ('return_type', 'type', 'aliased', 'value', 'args'):
+            visit(getattr(entity, attr, None))
+        params = (
+            getattr(entity, 'parameters', [])
+            + getattr(entity, 'template_parameters', []))
+        for param in params:
+            visit(param.type)
+            visit(param.default_value)
+    return references, len(distinct), parts
+
+def make_config(args):
+    return {
+        'include_private': False,
+        'legacy_behavior': args.legacy,
+        'default_namespace': 'bench',
+        'allowed_prefixes': ['bench::'],
+        'external_marker': '!!!',
+        'link_prefix': 'bench.ref.',
+    }
+
+def make_environment(config, bytecode_cache=None):
+    include_dir = os.path.join(_root, 'include')
+    loader = jinja2.FileSystemLoader(
+        [os.path.join(include_dir, 'docca'), include_dir])
+    return docca.construct_environment(loader, config, bytecode_cache)
+
+def render(env, entities, jobs=1):
+    output = io.StringIO()
+    docca.render(env, 'quickbook.jinja2', output, entities, jobs)
+    return output.getvalue()
+
+def bench_model(data, args):
+    """Model construction: resolve time and memory held by the model"""
+    tracemalloc.start()
+    entities, phases = build_model(data)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del entities
+
+    entities, phases = build_model(data)
+    for name, value in phases.items():
+        report(name, value * 1000, 'ms')
+    report('entities', len(entities))
+    references, distinct, _ = count_nodes(entities)
+    report('description nodes referenced', references)
+    report('description nodes allocated', distinct)
+    report('model memory (traced)', current / 1024 / 1024, 'MiB')
+    report('peak memory (traced)', peak / 1024 / 1024, 'MiB')
+
+def bench_render(data, args):
+    """Rendering of the default QuickBook template"""
+    # the model is also built without normalised phrase parts, i.e. with
+    # strings split and empty as they are in Doxygen XML, to compare with
+    normalize_parts = docca.normalize_parts
+    results = []
+    try:
+        for normalize in (tuple, normalize_parts):
+            docca.normalize_parts = normalize
+            entities, _ = build_model(data)
+            results.append((normalize is normalize_parts, entities))
+    finally:
+        docca.normalize_parts = normalize_parts
+
+    env = make_environment(make_config(args))
+    expected = None
+    for normalized, entities in results:
+        mode = 'normalised' if normalized else 'not normalised'
+        render(env, entities)
+        best = None
+        for _ in range(args.repeat):
+            output, elapsed = timed(render, env, entities)
+            best = min(best or elapsed, elapsed)
+        assert expected is None or output == expected
+        expected = output
+
+        _, _, parts = count_nodes(entities)
+        report('phrase parts, %s' % mode, parts)
+        report('render, %s (best of %s)' % (mode, args.repeat),
+            best * 1000, 'ms')
+
+    report('output size', len(output), 'chars')
+    report('fragment cache hits', env.fragments.hits)
+    report('fragment cache misses', env.fragments.misses)
+
+    for jobs in args.jobs:
+        best = None
+        for _ in range(args.repeat):
+            parallel, elapsed = timed(render, env, entities, jobs)
+            best = min(best or elapsed, elapsed)
+        assert parallel == output
+        report('render with %s jobs' % jobs, best * 1000, 'ms')
+
+def bench_compile(data, args):
+    """Template loading with and without bytecode cache or bundle"""
+    config = make_config(args)
+
+    def load(bytecode_cache=None):
+        env = make_environment(config, bytecode_cache)
+        _, elapsed = timed(lambda: [
+            env.get_template(name) for name in (
+                'quickbook.jinja2', 'docca/quickbook/components.jinja2')])
+        return env, elapsed
+
+    env, elapsed = load()
+    report('load without cache', elapsed * 1000, 'ms')
+    report('of which compilation', env.compile_time * 1000, 'ms')
+    report('templates compiled', env.compiled_templates)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env, elapsed = load(docca.BytecodeCache(cache_dir))
+        report('load with cold cache', elapsed * 1000, 'ms')
+        env, elapsed = load(docca.BytecodeCache(cache_dir))
+        report('load with warm cache', elapsed * 1000, 'ms')
+        report('of which compilation', env.compile_time * 1000, 'ms')
+        report('templates compiled', env.compiled_templates)
+
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        bundle = os.path.join(bundle_dir, 'bundle.zip')
+        docca.compile_templates(
+            make_environment(config), 'quickbook.jinja2', bundle)
+        env = docca.construct_environment(
+            jinja2.ModuleLoader(bundle), config)
+        _, elapsed = timed(lambda: [
+            env.get_template(name) for name in (
+                'quickbook.jinja2', 'docca/quickbook/components.jinja2')])
+        report('load from compiled bundle', elapsed * 1000, 'ms')
+
+def code_fragments(entities):
+    result = []
+    for entity in entities.values():
+        phrases = [getattr(entity, attr, None) for attr in (
+            'return_type', 'type', 'aliased', 'value')]
+        params = (
+            getattr(entity, 'parameters', [])
+            + getattr(entity, 'template_parameters', []))
+        phrases.extend(param.type for param in params)
+        phrases.extend(param.default_value for param in params)
+        for phrase in phrases:
+            if phrase is None:
+                continue
+            result.extend(part for part in phrase if isinstance(part, str))
+    return result
+
+def bench_replace(data, args):
+    """Application of replace_strings to code fragments"""
+    entities, _ = build_model(data)
+    fragments = code_fragments(entities)
+    report('fragments', len(fragments))
+
+    def reference(table):
+        for s in fragments:
+            for src, tgt in table.items():
+                s = re.sub(src, tgt, s, flags=re.U)
+
+    def compiled(table):
+        replacer = docca.StringReplacer(table)
+        for s in fragments:
+            replacer(s)
+
+    for rules in args.rules:
+        # a few rules match, most do not
+        table = dict(
+            ('\\bunused_name_%s\\b' % n, 'Unused_%s' % n)
+            for n in range(rules - 1))
+        table['\\bwidget_0\\b'] = '``[@https://example.com widget_0]``'
+        _, elapsed = timed(reference, table)
+        report('%s rules, re.sub loop' % rules, elapsed * 1000, 'ms')
+        _, elapsed = timed(compiled, table)
+        report('%s rules, StringReplacer' % rules, elapsed * 1000, 'ms')
+
+_startup_phases = [
+    ('interpreter', 'pass'),
+    ('import docca', 'import docca'),
+    ('parse arguments', '''
+import docca
+docca.parse_args(['docca', '-i', {index!r}])'''),
+    ('build model', '''
+import docca
+with open({index!r}) as file:
+    refs = list(docca.collect_compound_refs(file))
+docca.collect_data({data_dir!r}, refs)'''),
+    ('load templates', '''
+import docca
+args = docca.parse_args(['docca'])
+include_dir = docca.docca_include_dir({script!r})
+template = docca.template_file_name(include_dir, args)
+env = docca.construct_environment(
+    docca.template_loader(template, include_dir, args), dict())
+env.get_template('quickbook.jinja2')'''),
+]
+
+_tracked_modules = (
+    'argparse', 'hashlib', 'jinja2', 'multiprocessing', 'socket',
+    'socketserver', 'tempfile', 'traceback', 'xml.etree.ElementTree')
+
+def import_time(code):
+    # total time of top-level imports reported by -X importtime, and the
+    # modules imported
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=dict(os.environ, PYTHONPATH=_root),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True)
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        if not match:
+            continue
+        modules.add(match.group(3).strip())
+        if not match.group(2):
+            total += int(match.group(1))
+    return total / 1000, modules
+
+def bench_startup(data, args):
+    """Cold start: import time of each phase according to -X importtime"""
+    script = os.path.join(_root, 'docca.py')
+    for name, code in _startup_phases:
+        code = code.format(
+            index=data, data_dir=os.path.dirname(data), script=script)
+        best = None
+        for _ in range(args.repeat):
+            elapsed, modules = import_time(code)
+            best = min(best or elapsed, elapsed)
+        report(name, best, 'ms')
+        tracked = sorted(m for m in modules if m in _tracked_modules)
+        if tracked:
+            print('    ' + ' '.join(tracked))
+
+_scenarios = {
+    'model': bench_model,
+    'render': bench_render,
+    'compile': bench_compile,
+    'replace': bench_replace,
+    'startup': bench_startup,
+}
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description='Measures docca performance on synthetic Doxygen XML')
+    parser.add_argument(
+        'scenarios',
+        nargs='*',
+        help='Scenarios to run (%s); all by default' % ', '.join(_scenarios))
+    parser.add_argument(
+        '--classes', type=int, default=100, help='Number of classes')
+    parser.add_argument(
+        '--overloads',
+        type=int,
+        default=16,
+        help='Size of overload sets')
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Number of timed repetitions')
+    parser.add_argument(
+        '--legacy',
+        action='store_true',
+        help='Render with legacy_behavior configuration enabled')
+    parser.add_argument(
+        '--rules',
+        type=lambda s: [int(n) for n in s.split(',')],
+        default=[1, 10, 100],
+        help='Comma-separated numbers of replace_strings rules to try')
+    parser.add_argument(
+        '--jobs',
+        type=lambda s: [int(n) for n in s.split(',')],
+        default=[2, 4],
+        help='Comma-separated numbers of render jobs to try')
+    parser.add_argument(
+        '--data', help='Directory with Doxygen XML to use instead')
+    args = parser.parse_args(argv[1:])
+    for name in args.scenarios:
+        if name not in _scenarios:
+            parser.error('unknown scenario %s' % name)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.data:
+            data = os.path.join(args.data, 'index.xml')
+        else:
+            data = synthetic.generate(
+                tmpdir, classes=args.classes, overloads=args.overloads)
+
+        for name in (args.scenarios or _scenarios):
+            scenario = _scenarios[name]
+            print('%s: %s' % (name, scenario.__doc__))
+            scenario(data, args)
+
+if __name__ == '__main__':
+    main(sys.argv)
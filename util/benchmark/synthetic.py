@@ -0,0 +1,402 @@
+#
+# Copyright (c) 2024 Dmitry Arkhipov (grisumbras@yandex.ru)
+#
+# Distributed under the Boost Software License, Version 1.0. (See accompanying
+# file LICENSE_1_0.txt or copy at http://www.boost.org/LICENSE_1_0.txt)
+#
+# Official repository: https://github.com/boostorg/docca
+#
+
+# Generates a synthetic Doxygen XML tree which resembles the output for a
+# typical Boost library built with DISTRIBUTE_GROUP_DOC = YES: classes with
+# large overload sets sharing documentation, nested types, enums, related
+# functions, code examples and plenty of cross-references.
+
+import os
+
+from xml.sax.saxutils import escape, quoteattr
+
+
+_header = (
+    "<?xml version='1.0' encoding='UTF-8' standalone='no'?>\n"
+    '<doxygen version="1.9.1" xml:lang="en-US">\n')
+_footer = '</doxygen>\n'
+
+
+class _Library():
+    def __init__(self, classes, overloads, namespace):
+        self.classes = classes
+        self.overloads = overloads
+        self.ns = namespace
+        self.ns_id = 'namespace' + namespace
+        self.compounds = []
+
+    def class_id(self, n):
+        return 'class%s_1_1widget__%d' % (self.ns, n)
+
+    def nested_id(self, n):
+        return self.class_id(n) + '_1_1iterator'
+
+    def member_id(self, owner, name):
+        return '%s_1a%s' % (owner, name)
+
+    def class_ref(self, n, text=None):
+        return '<ref refid="%s" kindref="compound">%s</ref>' % (
+            self.class_id(n), escape(text or 'widget_%d' % n))
+
+    def external_ref(self):
+        return '<ref refid="%s" kindref="member">ostream</ref>' % (
+            self.member_id('namespacestd', 'ostream'))
+
+
+def _location(n, line):
+    return '<location file="bench/widget_%d.hpp" line="%d" column="5"/>' % (
+        n, line)
+
+def _param(type_, name=None, defval=None):
+    result = '<param><type>%s</type>' % type_
+    if name:
+        result += '<declname>%s</declname>' % name
+    if defval:
+        result += '<defval>%s</defval>' % defval
+    return result + '</param>'
+
+def _codeblock(lib, n):
+    lines = [
+        ('<highlight class="normal">%s<sp/>w;</highlight>'
+            % lib.class_ref(n)),
+        ('<highlight class="normal">w.assign(<sp/></highlight>'
+            '<highlight class="stringliteral">&quot;text&quot;</highlight>'
+            '<highlight class="normal"><sp/>);</highlight>'),
+        ('<highlight class="keywordflow">for</highlight>'
+            '<highlight class="normal">(<sp/></highlight>'
+            '<highlight class="keyword">auto</highlight>'
+            '<highlight class="normal"><sp/>it<sp/>=<sp/>w.begin();'
+            '<sp/>it<sp/>!=<sp/>w.end();<sp/>++it<sp/>)</highlight>'),
+        ('<highlight class="normal"><sp/><sp/><sp/><sp/>'
+            'std::cout<sp/>&lt;&lt;<sp/>*it;</highlight>'),
+    ]
+    return (
+        '<programlisting>'
+        + ''.join(('<codeline>%s</codeline>' % line) for line in lines)
+        + '</programlisting>')
+
+def _overload_docs(lib, n):
+    other = (n + 1) % lib.classes
+    brief = (
+        '<briefdescription>\n<para>Assign new contents to the widget.'
+        ' </para>\n</briefdescription>\n')
+    detailed = (
+        '<detaileddescription>\n'
+        '<para>Replaces the contents of the container with the contents'
+        ' of %(ref)s. All iterators,\npointers and references are'
+        ' invalidated. See <computeroutput>%(other)s</computeroutput>\n'
+        'for details.</para>\n'
+        '<para><itemizedlist>\n'
+        '<listitem><para><bold>Complexity</bold> linear in the size of'
+        ' the input.</para>\n</listitem>\n'
+        '<listitem><para><emphasis>Exception safety</emphasis> strong'
+        ' guarantee.</para>\n</listitem>\n'
+        '</itemizedlist>\n'
+        '%(code)s\n'
+        '<parameterlist kind="param"><parameteritem>\n'
+        '<parameternamelist><parametername>other</parametername>'
+        '</parameternamelist>\n'
+        '<parameterdescription><para>The source widget.</para>'
+        '</parameterdescription>\n'
+        '</parameteritem></parameterlist>\n'
+        '<simplesect kind="return"><para><computeroutput>*this'
+        '</computeroutput></para></simplesect>\n'
+        '<simplesect kind="note"><para>Uses %(ext)s for'
+        ' diagnostics.</para></simplesect>\n'
+        '<simplesect kind="see"><para>%(ref)s\n%(other)s\n'
+        '<computeroutput>swap</computeroutput></para></simplesect>\n'
+        '</para>\n'
+        '</detaileddescription>\n'
+    ) % dict(
+        ref=lib.class_ref(other),
+        other=lib.class_ref(other, 'widget_%d::assign' % other),
+        code=_codeblock(lib, n),
+        ext=lib.external_ref())
+    return brief + detailed
+
+def _function(lib, owner, n, name, index, ret, params, extra='', attrs='',
+              docs=None):
+    args = '(%s)' % ', '.join(
+        '%s %s' % (t, nm) for (t, nm, *_) in params)
+    return (
+        '<memberdef kind="function" id="%(id)s" prot="public" static="no"'
+        ' const="no" explicit="no" inline="yes" virt="non-virtual"%(attrs)s>'
+        '\n<type>%(ret)s</type>\n<definition>%(ret)s %(name)s</definition>\n'
+        '<argsstring>%(args)s%(extra)s</argsstring>\n<name>%(name)s</name>\n'
+        '%(params)s\n%(docs)s%(loc)s\n</memberdef>\n'
+    ) % dict(
+        id=lib.member_id(owner, '%s_%d' % (
+            name.replace('~', 'dtor_').replace('operator', 'op_')
+                .replace('=', 'eq').replace('[]', 'idx'),
+            index)),
+        attrs=attrs,
+        ret=ret,
+        name=escape(name),
+        args=escape(args),
+        extra=escape(extra),
+        params=''.join(_param(*p) for p in params),
+        docs=docs if docs is not None else _overload_docs(lib, n),
+        loc=_location(n, 100 + index))
+
+def _variable(lib, owner, n, name, type_, static=False, init=None):
+    return (
+        '<memberdef kind="variable" id="%(id)s" prot="public"'
+        ' static="%(static)s" mutable="no">\n<type>%(type)s</type>\n'
+        '<definition>%(type)s %(name)s</definition>\n<argsstring></argsstring>'
+        '\n<name>%(name)s</name>\n%(init)s<briefdescription>\n<para>The'
+        ' %(name)s value of the widget.</para>\n</briefdescription>\n'
+        '<detaileddescription>\n</detaileddescription>\n%(loc)s\n'
+        '</memberdef>\n'
+    ) % dict(
+        id=lib.member_id(owner, name),
+        static='yes' if static else 'no',
+        type=type_,
+        name=name,
+        init=('<initializer>%s</initializer>\n' % escape(init)) if init else '',
+        loc=_location(n, 50))
+
+def _typedef(lib, owner, n, name, type_):
+    return (
+        '<memberdef kind="typedef" id="%(id)s" prot="public" static="no">\n'
+        '<type>%(type)s</type>\n<definition>using %(name)s = %(type)s'
+        '</definition>\n<argsstring></argsstring>\n<name>%(name)s</name>\n'
+        '<briefdescription>\n<para>The %(name)s type.</para>\n'
+        '</briefdescription>\n<detaileddescription>\n'
+        '</detaileddescription>\n%(loc)s\n</memberdef>\n'
+    ) % dict(
+        id=lib.member_id(owner, name),
+        type=type_,
+        name=name,
+        loc=_location(n, 40))
+
+def _enum(lib, owner, n, name, values):
+    result = (
+        '<memberdef kind="enum" id="%s" prot="public" static="no"'
+        ' strong="yes">\n<type>unsigned char</type>\n<name>%s</name>\n'
+    ) % (lib.member_id(owner, name), name)
+    for value in values:
+        result += (
+            '<enumvalue id="%s" prot="public">\n<name>%s</name>\n'
+            '<briefdescription>\n<para>The %s mode.</para>\n'
+            '</briefdescription>\n<detaileddescription>\n'
+            '</detaileddescription>\n</enumvalue>\n'
+        ) % (lib.member_id(owner, name + '_' + value), value, value)
+    result += (
+        '<briefdescription>\n<para>Widget modes.</para>\n</briefdescription>'
+        '\n<detaileddescription>\n</detaileddescription>\n%s\n</memberdef>\n'
+    ) % _location(n, 30)
+    return result
+
+def _class(lib, n):
+    cid = lib.class_id(n)
+    other = lib.class_ref((n + 1) % lib.classes)
+    funcs = []
+    funcs.append(_function(
+        lib, cid, n, 'widget_%d' % n, 0, '', [], extra=' noexcept',
+        attrs=' noexcept="yes"',
+        docs=(
+            '<briefdescription>\n<para>Constructor.</para>\n'
+            '</briefdescription>\n<detaileddescription>\n'
+            '</detaileddescription>\n')))
+    funcs.append(_function(
+        lib, cid, n, 'widget_%d' % n, 1, '',
+        [('%s const &amp;' % other, 'other')],
+        docs=(
+            '<briefdescription>\n<para>Constructor.</para>\n'
+            '</briefdescription>\n<detaileddescription>\n'
+            '</detaileddescription>\n')))
+    funcs.append(_function(
+        lib, cid, n, '~widget_%d' % n, 0, '', [],
+        docs=(
+            '<briefdescription>\n<para>Destructor.</para>\n'
+            '</briefdescription>\n<detaileddescription>\n'
+            '</detaileddescription>\n')))
+    for k in range(lib.overloads):
+        params = [
+            ('%s const &amp;' % lib.class_ref((n + k) % lib.classes), 'other'),
+            ('std::size_t', 'count', '%d' % k),
+        ]
+        if k % 2:
+            params.append((
+                'storage_ptr', 'sp', '{}'))
+        funcs.append(_function(
+            lib, cid, n, 'assign', k,
+            '%s &amp;' % lib.class_ref(n), params))
+    funcs.append(_function(
+        lib, cid, n, 'operator[]', 0, 'value_type &amp;',
+        [('std::size_t', 'pos')]))
+    funcs.append(_function(
+        lib, cid, n, 'operator=', 0, 'widget_%d &amp;' % n,
+        [('widget_%d &amp;&amp;' % n, 'other')],
+        extra=' noexcept', attrs=' noexcept="yes"'))
+
+    static_funcs = [_function(
+        lib, cid, n, 'make', 0, lib.class_ref(n), [('int', 'seed')]
+    ).replace('static="no"', 'static="yes"', 1)]
+
+    friends = [_function(
+        lib, cid, n, 'swap', 0, 'void',
+        [('%s &amp;' % lib.class_ref(n), 'lhs'),
+         ('%s &amp;' % lib.class_ref(n), 'rhs')]
+    ).replace('kind="function"', 'kind="friend"', 1)]
+
+    related = [_function(
+        lib, lib.ns_id, n, 'operator==', n, 'bool',
+        [('%s const &amp;' % lib.class_ref(n), 'lhs'),
+         ('%s const &amp;' % lib.class_ref(n), 'rhs')])]
+
+    data = [
+        _variable(lib, cid, n, 'size_', 'std::size_t'),
+        _variable(
+            lib, cid, n, 'npos', 'constexpr std::size_t', static=True,
+            init='= std::size_t(-1)'),
+    ]
+    types = [
+        _typedef(lib, cid, n, 'value_type', 'char'),
+        _typedef(lib, cid, n, 'reference', 'value_type &amp;'),
+        _enum(lib, cid, n, 'mode', ['read', 'write', 'append']),
+    ]
+
+    result = _header + (
+        '<compounddef id="%(id)s" kind="class" language="C++" prot="public">\n'
+        '<compoundname>%(ns)s::widget_%(n)d</compoundname>\n'
+        '<innerclass refid="%(nested)s" prot="public">'
+        '%(ns)s::widget_%(n)d::iterator</innerclass>\n'
+    ) % dict(id=cid, ns=lib.ns, n=n, nested=lib.nested_id(n))
+    if n % 3 == 0:
+        result += (
+            '<templateparamlist>\n'
+            '<param><type>class</type><declname>Allocator</declname>'
+            '<defval>std::allocator&lt;char&gt;</defval></param>\n'
+            '</templateparamlist>\n')
+    result += '<sectiondef kind="public-type">\n%s</sectiondef>\n' % (
+        ''.join(types))
+    result += '<sectiondef kind="public-func">\n%s</sectiondef>\n' % (
+        ''.join(funcs))
+    result += '<sectiondef kind="public-static-func">\n%s</sectiondef>\n' % (
+        ''.join(static_funcs))
+    result += '<sectiondef kind="public-attrib">\n%s</sectiondef>\n' % (
+        ''.join(data))
+    result += '<sectiondef kind="friend">\n%s</sectiondef>\n' % (
+        ''.join(friends))
+    result += '<sectiondef kind="related">\n%s</sectiondef>\n' % (
+        ''.join(related))
+    result += (
+        '<briefdescription>\n<para>A widget with number %(n)d.</para>\n'
+        '</briefdescription>\n<detaileddescription>\n<para>Widgets are'
+        ' containers similar to %(other)s.\nThey are used together with'
+        ' <ulink url="https://example.com/widgets">external widgets</ulink>'
+        '\nand %(ext)s.</para>\n<para><table rows="2" cols="2"><row><entry'
+        ' thead="yes"><para>Operation</para></entry><entry thead="yes"><para>'
+        'Complexity</para></entry></row><row><entry thead="no"><para>assign'
+        '</para></entry><entry thead="no"><para>linear</para></entry></row>'
+        '</table>\n</para>\n</detaileddescription>\n%(loc)s\n</compounddef>\n'
+    ) % dict(n=n, other=other, ext=lib.external_ref(), loc=_location(n, 20))
+    result += _footer
+    lib.compounds.append((cid, 'class', result))
+
+    nested = _header + (
+        '<compounddef id="%(id)s" kind="class" language="C++" prot="public">\n'
+        '<compoundname>%(ns)s::widget_%(n)d::iterator</compoundname>\n'
+        '<sectiondef kind="public-func">\n%(funcs)s</sectiondef>\n'
+        '<briefdescription>\n<para>Iterator over the widget.</para>\n'
+        '</briefdescription>\n<detaileddescription>\n</detaileddescription>\n'
+        '%(loc)s\n</compounddef>\n'
+    ) % dict(
+        id=lib.nested_id(n),
+        ns=lib.ns,
+        n=n,
+        funcs=_function(
+            lib, lib.nested_id(n), n, 'operator++', 0, 'iterator &amp;', [],
+            docs=(
+                '<briefdescription>\n<para>Advance.</para>\n'
+                '</briefdescription>\n<detaileddescription>\n'
+                '</detaileddescription>\n')),
+        loc=_location(n, 60))
+    nested += _footer
+    lib.compounds.append((lib.nested_id(n), 'class', nested))
+
+    return related
+
+def _namespace(lib, related):
+    funcs = list(related)
+    for k in range(lib.overloads):
+        funcs.append(_function(
+            lib, lib.ns_id, k % lib.classes, 'make_widget', k,
+            lib.class_ref(k % lib.classes),
+            [('std::string_view', 'name'), ('int', 'flags', '0')]))
+    result = _header + (
+        '<compounddef id="%(id)s" kind="namespace" language="C++">\n'
+        '<compoundname>%(ns)s</compoundname>\n%(classes)s'
+        '<sectiondef kind="typedef">\n%(typedef)s</sectiondef>\n'
+        '<sectiondef kind="var">\n%(var)s</sectiondef>\n'
+        '<sectiondef kind="func">\n%(funcs)s</sectiondef>\n'
+        '<briefdescription>\n</briefdescription>\n<detaileddescription>\n'
+        '</detaileddescription>\n%(loc)s\n</compounddef>\n'
+    ) % dict(
+        id=lib.ns_id,
+        ns=lib.ns,
+        classes=''.join(
+            '<innerclass refid="%s" prot="public">%s::widget_%d</innerclass>\n'
+            % (lib.class_id(n), lib.ns, n)
+            for n in range(lib.classes)),
+        typedef=_typedef(lib, lib.ns_id, 0, 'string_view', 'std::string_view'),
+        var=_variable(
+            lib, lib.ns_id, 0, 'default_mode', 'constexpr int', init='= 0'),
+        funcs=''.join(funcs),
+        loc=_location(0, 1))
+    result += _footer
+    lib.compounds.append((lib.ns_id, 'namespace', result))
+
+def _std(lib):
+    ostream = (
+        '<memberdef kind="typedef" id="%s" prot="public" static="no">\n'
+        '<type>std::basic_ostream&lt;char&gt;</type>\n<name>ostream</name>\n'
+        '<briefdescription>\n<para>!!!</para>\n</briefdescription>\n'
+        '<detaileddescription>\n<para><simplesect kind="see"><para>'
+        'https://en.cppreference.com/w/cpp/io/basic_ostream</para>'
+        '</simplesect></para>\n</detaileddescription>\n</memberdef>\n'
+    ) % lib.member_id('namespacestd', 'ostream')
+    result = _header + (
+        '<compounddef id="namespacestd" kind="namespace" language="C++">\n'
+        '<compoundname>std</compoundname>\n'
+        '<sectiondef kind="typedef">\n%s</sectiondef>\n'
+        '<briefdescription>\n</briefdescription>\n<detaileddescription>\n'
+        '</detaileddescription>\n</compounddef>\n'
+    ) % ostream
+    result += _footer
+    lib.compounds.append(('namespacestd', 'namespace', result))
+
+def generate(directory, classes=20, overloads=8, namespace='bench'):
+    """Writes index.xml and compound files into directory.
+
+    Returns the path to index.xml.
+    """
+    lib = _Library(classes, overloads, namespace)
+    related = []
+    for n in range(classes):
+        related.extend(_class(lib, n))
+    _namespace(lib, related)
+    _std(lib)
+
+    os.makedirs(directory, exist_ok=True)
+    index = ['<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+             '<doxygenindex version="1.9.1" xml:lang="en-US">\n']
+    for refid, kind, text in lib.compounds:
+        index.append('  <compound refid=%s kind=%s></compound>\n' % (
+            quoteattr(refid), quoteattr(kind)))
+        path = os.path.join(directory, refid + '.xml')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+    index.append('</doxygenindex>\n')
+
+    index_path = os.path.join(directory, 'index.xml')
+    with open(index_path, 'w', encoding='utf-8') as file:
+        file.write(''.join(index))
+    return index_path